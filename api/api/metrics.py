@@ -0,0 +1,216 @@
+"""Request metrics of the api project, exposed in the Prometheus text format.
+
+`MetricsMiddleware` records, for every route and method, the latency of the
+requests, the amount of SQL queries they ran and the time spent on them, and
+the size of the responses. The `metrics` view exposes them, along with the
+data breaches response cache counters, on `/metrics`.
+
+Metrics are kept in the memory of each process, so every worker exposes its
+own. Configure it with the `API_METRICS` setting:
+
+    * ENABLED : record metrics (default `True`).
+    * QUERY_COUNT_HEADER : add the `X-DB-Query-Count` and `X-DB-Query-Time`
+      headers to the responses (default `DEBUG`).
+"""
+import threading
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from data_breaches.caching import get_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+def get_setting(name):
+    """Get a setting of the `API_METRICS` dict."""
+    defaults = {
+        'ENABLED' : True,
+        'QUERY_COUNT_HEADER' : settings.DEBUG,
+    }
+    return getattr(settings, 'API_METRICS', {}).get(name, defaults[name])
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    return '{' + ','.join('%s="%s"' % (name, escape(value)) for name, value in labels) + '}'
+
+class Histogram:
+    """
+    Prometheus histogram with one series for each set of labels.
+
+    Attributes:
+        name (str) : metric name.
+        help (str) : description of the metric.
+        buckets (tuple) : upper bounds of the buckets, `+Inf` is added.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        """Count `value` on the series of `labels`, a tuple of (name, value) pairs."""
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {'buckets' : [0] * len(self.buckets), 'sum' : 0, 'count' : 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def samples(self):
+        for labels, series in self.series.items():
+            for bound, count in zip(self.buckets, series['buckets']):
+                yield self.name + '_bucket', labels + (('le', bound),), count
+            yield self.name + '_bucket', labels + (('le', '+Inf'),), series['count']
+            yield self.name + '_sum', labels, series['sum']
+            yield self.name + '_count', labels, series['count']
+
+class Counter:
+    """Prometheus counter with one series for each set of labels."""
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.series = {}
+
+    def inc(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in self.series.items():
+            yield self.name, labels, value
+
+class Registry:
+    """Metrics recorded by `MetricsMiddleware`, shared by the threads of a process."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.requests = Counter('http_requests_total', 'Requests by route, method and status.')
+            self.latency = Histogram('http_request_duration_seconds', 'Request latency.', LATENCY_BUCKETS)
+            self.queries = Histogram('http_request_db_queries', 'SQL queries run by a request.', QUERY_BUCKETS)
+            self.query_time = Counter('http_request_db_seconds_total', 'Time spent on SQL queries.')
+            self.size = Histogram('http_response_size_bytes', 'Response body size.', SIZE_BUCKETS)
+
+    def record(self, route, method, status, seconds, queries, query_time, size):
+        labels = (('route', route), ('method', method))
+        with self.lock:
+            self.requests.inc(labels + (('status', status),))
+            self.latency.observe(labels, seconds)
+            self.queries.observe(labels, queries)
+            self.query_time.inc(labels, query_time)
+            if size is not None:
+                self.size.observe(labels, size)
+
+    def render(self, extra=()):
+        """
+        Render the metrics in the Prometheus text format.
+
+        Args:
+            extra (iterable) : more (name, help, kind, value) metrics without labels.
+        """
+        lines = []
+        with self.lock:
+            for metric in [self.requests, self.latency, self.queries, self.query_time, self.size]:
+                lines.append('# HELP %s %s' % (metric.name, metric.help))
+                lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+                for name, labels, value in metric.samples():
+                    lines.append('%s%s %s' % (name, format_labels(labels), value))
+        for name, help, kind, value in extra:
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.append('%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+class QueryCounter:
+    """Database execute wrapper counting the queries run and the time they took."""
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+    def wrap(self):
+        """Context manager installing the wrapper on every database connection."""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+class MetricsMiddleware:
+    """
+    Record the latency, SQL queries and response size of every request on
+    `registry`, by route (the url name, `databreaches-list` for example) and
+    method. Streamed responses are recorded once they are fully sent, with the
+    queries run while streaming.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_setting('ENABLED'):
+            return self.get_response(request)
+
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with counter.wrap():
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        route = match.view_name if match is not None else 'unmatched'
+
+        if response.streaming:
+            response.streaming_content = self.stream(response.streaming_content, counter, start, route, request.method, response.status_code)
+            return response
+
+        self.record(counter, start, route, request.method, response.status_code, len(response.content))
+        if get_setting('QUERY_COUNT_HEADER'):
+            response['X-DB-Query-Count'] = str(counter.count)
+            response['X-DB-Query-Time'] = '%.6f' % counter.seconds
+        return response
+
+    def stream(self, content, counter, start, route, method, status):
+        size = 0
+        try:
+            iterator = iter(content)
+            while True:
+                with counter.wrap():
+                    chunk = next(iterator, None)
+                if chunk is None:
+                    break
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.record(counter, start, route, method, status, size)
+
+    def record(self, counter, start, route, method, status, size):
+        registry.record(route, method, status, time.perf_counter() - start, counter.count, counter.seconds, size)
+
+def metrics(request):
+    """Expose the request metrics and the response cache counters in the Prometheus text format."""
+    stats = get_stats()
+    extra = [
+        ('data_breaches_cache_hits_total', 'Responses served from the cache.', 'counter', stats['hits']),
+        ('data_breaches_cache_misses_total', 'Responses not found in the cache.', 'counter', stats['misses']),
+    ]
+    return HttpResponse(registry.render(extra), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -39,10 +39,13 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework_api_key',
+    'django_filters',
     'data_breaches.apps.DataBreachesConfig'
 ]
 
 MIDDLEWARE = [
+    # first, so the time and queries of the other middlewares are recorded
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +87,27 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+#
+# The local memory cache is per process. The verified api keys cache of
+# DATA_BREACHES_CACHE is off with it and requires a cache shared by every
+# worker, for example:
+#
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#         'LOCATION': 'redis://127.0.0.1:6379',
+#     }
+# }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -127,6 +151,57 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    # json encoded and decoded with orjson when it is installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'data_breaches.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'data_breaches.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Default amount of data breaches per page and biggest page size a client can
+# ask for with the `page_size` query parameter
+DATA_BREACHES_PAGE_SIZE = 100
+DATA_BREACHES_MAX_PAGE_SIZE = 1000
+
+# Biggest amount of ids a client can look up at once with the batch action
+DATA_BREACHES_MAX_BATCH_SIZE = 1000
+
+# Biggest payload, in bytes, accepted by the import jobs endpoint
+DATA_BREACHES_MAX_IMPORT_SIZE = 100 * 1024 * 1024
+
+# Cache of the data breaches list and detail responses. Responses are
+# invalidated whenever data breaches, entities, organization types or sources
+# change. Use a shared cache on CACHES (file based, redis...) to share it
+# between workers.
+DATA_BREACHES_CACHE = {
+    'ENABLED': True,
+    # alias of the cache in CACHES
+    'ALIAS': 'default',
+    # seconds a response is kept
+    'TIMEOUT': 300,
+    # seconds a verified api key is kept, 0 to verify keys on every request.
+    # Requires a shared cache on CACHES, so a revoked key is refused by every
+    # worker: with the default local memory cache keys are not cached
+    'API_KEY_TIMEOUT': 60,
+}
+
+# Request metrics exposed on /metrics, see api.metrics
+API_METRICS = {
+    'ENABLED': True,
+    # add the X-DB-Query-Count and X-DB-Query-Time headers to the responses
+    'QUERY_COUNT_HEADER': DEBUG,
+}
+
 # Config Django App for Heroku
 import django_heroku
 django_heroku.settings(locals())
@@ -0,0 +1,311 @@
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_api_key.models import APIKey
+from rest_framework_api_key.permissions import HasAPIKey
+from .caching import get_cache
+from .importers import BulkImporter, batched
+from .models import *
+from .permissions import CachedHasAPIKey
+from .renderers import FastJSONParser, FastJSONRenderer
+
+ORGANIZATION_TYPES = [
+    'web', 'retail', 'financial', 'healthcare', 'government', 'telecoms',
+    'gaming', 'social network', 'tech', 'academic', 'energy', 'transport',
+]
+METHODS = ['hacked', 'poor security', 'lost device', 'inside job', 'accidentally published']
+
+@contextmanager
+def count_queries(counter):
+    """Count the queries run inside the block on `counter['queries']`."""
+    def wrapper(execute, sql, params, many, context):
+        counter['queries'] += 1
+        return execute(sql, params, many, context)
+
+    counter.setdefault('queries', 0)
+    with connection.execute_wrapper(wrapper):
+        yield counter
+
+def measure(func, repeat, setup=None):
+    """
+    Call `func` `repeat` times, calling `setup` out of the measure before each
+    call. The peak of memory is measured on one more call, as tracing memory
+    allocations slows the calls down.
+
+    Returns:
+        Dictionary with the amount of `calls`, total `seconds`, microseconds
+        per call (`us_per_call`), queries per call (`queries_per_call`) and the
+        peak of memory allocated by a call in KiB (`peak_memory_kb`).
+    """
+    counter = {}
+    elapsed = 0
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        with count_queries(counter):
+            start = time.perf_counter()
+            func()
+            elapsed += time.perf_counter() - start
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'calls' : repeat,
+        'seconds' : elapsed,
+        'us_per_call' : elapsed / repeat * 1e6,
+        'queries_per_call' : counter['queries'] / repeat,
+        'peak_memory_kb' : peak / 1024,
+    }
+
+def generate_databreaches(size, seed=0):
+    """
+    Generate `size` synthetic data breaches in the format of the scraper, the
+    same ones for the same `size` and `seed`. There is about one entity for
+    every three data breaches: most entities have a single data breach and a
+    few have many. Entities have one to three organization types and data
+    breaches one to four sources.
+    """
+    rng = random.Random(seed)
+    entities = max(size // 3, 1)
+    for i in range(size):
+        if i % 2:
+            entity = min(int(rng.paretovariate(1.2)) - 1, entities - 1)
+        else:
+            entity = rng.randrange(entities)
+        entity_rng = random.Random(entity)
+        yield {
+            'entity' : {
+                'name' : 'Entity %d %s' % (entity, entity_rng.choice(['Inc', 'Corp', 'Group', 'Ltd', 'Bank', 'Online'])),
+                'organization_type' : entity_rng.sample(ORGANIZATION_TYPES, entity_rng.randint(1, 3))
+            },
+            'year' : rng.randint(2004, 2024),
+            'records' : int(rng.lognormvariate(11, 2.5)) + 1,
+            'method' : rng.choice(METHODS),
+            'sources' : [
+                'https://news%d.example.com/%d/breach-%d' % (rng.randrange(50), rng.randint(2004, 2024), i * 4 + j)
+                for j in range(rng.randint(1, 4))
+            ]
+        }
+
+def clear_data():
+    """Delete every data breach, source, organization type and entity."""
+    with connection.cursor() as cursor:
+        for model in [DataBreachSource, Source, DataBreach, EntityOrganizationType, OrganizationType, Entity]:
+            cursor.execute('DELETE FROM %s' % connection.ops.quote_name(model._meta.db_table))
+
+# size of the dataset loaded by load_dataset
+_loaded = {}
+
+def load_dataset(size):
+    """Load `size` generated data breaches, unless they are already loaded."""
+    if _loaded.get('size') == size:
+        return
+    clear_data()
+    importer = BulkImporter()
+    for batch in batched(generate_databreaches(size), 1000):
+        importer.load(batch)
+    _loaded['size'] = size
+
+def get(client, url, params=None):
+    """Get `url` with the test client, reading streamed responses to the end."""
+    response = client.get(url, params)
+    assert response.status_code == 200, response.status_code
+    if response.streaming:
+        for chunk in response.streaming_content:
+            pass
+    return response
+
+def benchmark_auth(repeat=1000):
+    """
+    Measure the cost of verifying the api key of a write request with
+    HasAPIKey and with CachedHasAPIKey, once its key is cached on a file based
+    cache, as keys are only cached on shared caches.
+    """
+    api_key_obj, api_key = APIKey.objects.create_key(name='Benchmark APIKey')
+    request = APIRequestFactory().post('/api/databreaches/', HTTP_AUTHORIZATION='Api-Key ' + api_key)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as location, override_settings(CACHES={
+        'default' : {'BACKEND' : 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION' : location}
+    }):
+        get_cache().clear()
+        for name, permission in [('HasAPIKey', HasAPIKey()), ('CachedHasAPIKey', CachedHasAPIKey())]:
+            assert permission.has_permission(request, None)
+            results[name] = measure(lambda: permission.has_permission(request, None), repeat)
+
+    api_key_obj.delete()
+    return results
+
+def databreaches_data(size):
+    """Build `size` data breaches representations, like the ones of the list endpoint."""
+    return [dict(id=i, **data) for i, data in enumerate(generate_databreaches(size), 1)]
+
+def benchmark_render(repeat=10, size=50000):
+    """
+    Measure encoding a list of `size` data breaches with JSONRenderer and
+    FastJSONRenderer, and decoding it with JSONParser and FastJSONParser.
+    `identical` tells if both renderers gave the same bytes.
+    """
+    data = databreaches_data(size)
+    body = JSONRenderer().render(data)
+
+    results = {}
+    for name, renderer in [('JSONRenderer', JSONRenderer()), ('FastJSONRenderer', FastJSONRenderer())]:
+        results[name] = measure(lambda: renderer.render(data), repeat)
+    results['FastJSONRenderer']['identical'] = FastJSONRenderer().render(data) == body
+
+    for name, parser in [('JSONParser', JSONParser()), ('FastJSONParser', FastJSONParser())]:
+        results[name] = measure(lambda: parser.parse(io.BytesIO(body)), repeat)
+    results['bytes'] = len(body)
+    return results
+
+def benchmark_populate(repeat=1, size=10000):
+    """
+    Measure `populate_db --bulk` loading a file with `size` data breaches in
+    an empty database, and `populate_db --sync` on the same file once it is
+    loaded, when nothing changed.
+    """
+    fd, path = tempfile.mkstemp(suffix='.ndjson')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for data in generate_databreaches(size):
+                f.write(json.dumps(data) + '\n')
+
+        results = {
+            'bulk' : measure(lambda: call_command('populate_db', path, '--bulk', verbosity=0), repeat, setup=clear_data),
+            'sync' : measure(lambda: call_command('populate_db', path, '--sync', verbosity=0), repeat),
+        }
+    finally:
+        os.remove(path)
+    _loaded['size'] = size
+
+    for result in results.values():
+        result['rows_per_second'] = size / (result['seconds'] / repeat)
+    return results
+
+def benchmark_bulk_post(repeat=5, size=10000, batch=1000):
+    """Measure creating `batch` data breaches with a single POST of a list."""
+    load_dataset(size)
+    api_key_obj, api_key = APIKey.objects.create_key(name='Benchmark APIKey')
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Api-Key ' + api_key)
+    data = list(generate_databreaches(batch, seed=1))
+
+    def post():
+        response = client.post(reverse('databreaches-list'), data, format='json')
+        assert response.status_code == 201, response.status_code
+
+    results = measure(post, repeat)
+    results['rows_per_second'] = batch / (results['seconds'] / repeat)
+    api_key_obj.delete()
+    # the dataset has the posted data breaches now
+    _loaded.clear()
+    return results
+
+def benchmark_requests(requests, repeat, size):
+    """
+    Measure GET requests on a dataset of `size` data breaches, with the
+    response cache disabled so every request reads the database.
+
+    Args:
+        requests (dict) : url, or tuple with url and query parameters, by name.
+    """
+    load_dataset(size)
+    client = APIClient()
+    results = {}
+    with override_settings(DATA_BREACHES_CACHE={'ENABLED' : False}):
+        for name, request in requests.items():
+            url, params = request if isinstance(request, tuple) else (request, None)
+            results[name] = measure(lambda: get(client, url, params), repeat)
+    return results
+
+def benchmark_list(repeat=50, size=10000):
+    """Measure the first page of the list with the default and the biggest page size."""
+    return benchmark_requests({
+        'page_size_100' : reverse('databreaches-list'),
+        'page_size_1000' : (reverse('databreaches-list'), {'page_size' : 1000}),
+    }, repeat, size)
+
+def benchmark_sparse(repeat=50, size=10000):
+    """
+    Measure a page of 1000 data breaches with the full representation and
+    with sparse fieldsets, with the size of each response in `bytes`.
+    """
+    url = reverse('databreaches-list')
+    requests = {
+        'full' : (url, {'page_size' : 1000}),
+        'fields' : (url, {'page_size' : 1000, 'fields' : 'id,entity.name,year,records'}),
+        'fields_sources' : (url, {'page_size' : 1000, 'fields' : 'id,entity.name,year,records', 'expand' : 'sources'}),
+    }
+    results = benchmark_requests(requests, repeat, size)
+    client = APIClient()
+    for name, (url, params) in requests.items():
+        results[name]['bytes'] = len(get(client, url, params).content)
+    return results
+
+def benchmark_detail(repeat=200, size=10000):
+    """Measure the details of data breaches spread over the dataset."""
+    load_dataset(size)
+    ids = list(DataBreach.objects.order_by('id').values_list('id', flat=True))
+    urls = [reverse('databreaches-detail', args=[pk]) for pk in random.Random(0).choices(ids, k=repeat + 1)]
+    client = APIClient()
+    with override_settings(DATA_BREACHES_CACHE={'ENABLED' : False}):
+        return measure(lambda: get(client, urls.pop()), repeat)
+
+def benchmark_filter(repeat=50, size=10000):
+    """Measure the list filtered by data breach fields, organization type and search."""
+    return benchmark_requests({
+        'year_records' : (reverse('databreaches-list'), {'year__gte' : 2015, 'records__gte' : 100000}),
+        'organization_type' : (reverse('databreaches-list'), {'organization_type' : 'financial', 'method' : 'hacked'}),
+        'search' : (reverse('databreaches-list'), {'search' : 'entity 1'}),
+        'autocomplete' : (reverse('databreaches-autocomplete'), {'q' : 'entity 12'}),
+    }, repeat, size)
+
+def benchmark_stats(repeat=20, size=10000):
+    """Measure the statistics of the whole dataset and of a filtered one."""
+    return benchmark_requests({
+        'all' : reverse('databreaches-stats'),
+        'filtered' : (reverse('databreaches-stats'), {'year__gte' : 2015}),
+    }, repeat, size)
+
+def benchmark_export(repeat=2, size=10000):
+    """Measure exporting the whole dataset as ndjson and csv."""
+    results = benchmark_requests({
+        'ndjson' : (reverse('databreaches-export'), {'format' : 'ndjson'}),
+        'csv' : (reverse('databreaches-export'), {'format' : 'csv'}),
+    }, repeat, size)
+    for result in results.values():
+        result['rows_per_second'] = size / (result['seconds'] / repeat)
+    return results
+
+SUITES = {
+    'auth' : benchmark_auth,
+    'render' : benchmark_render,
+    'populate' : benchmark_populate,
+    'bulk_post' : benchmark_bulk_post,
+    'list' : benchmark_list,
+    'sparse' : benchmark_sparse,
+    'detail' : benchmark_detail,
+    'filter' : benchmark_filter,
+    'stats' : benchmark_stats,
+    'export' : benchmark_export,
+}
@@ -0,0 +1,157 @@
+from .caching import invalidate
+from .models import *
+
+def raw_delete(queryset):
+    """
+    Delete the rows of `queryset` with a single DELETE query. Unlike
+    `QuerySet.delete`, rows are not fetched to send `post_delete` signals one
+    by one, so callers must `invalidate` the cache themselves.
+
+    Returns:
+        Amount of rows deleted.
+    """
+    return queryset._raw_delete(queryset.db)
+
+def delete_orphan_sources(source_ids, batch_size=1000):
+    """
+    Delete the sources of `source_ids` that no data breach cites anymore, with
+    a DELETE query for every `batch_size` sources.
+
+    Returns:
+        Amount of sources deleted.
+    """
+    source_ids = list(source_ids)
+    deleted = 0
+    for i in range(0, len(source_ids), batch_size):
+        batch = source_ids[i:i + batch_size]
+        deleted += raw_delete(
+            Source.objects.filter(id__in=batch).exclude(
+                id__in=DataBreachSource.objects.filter(source_id__in=batch).values('source_id')
+            )
+        )
+    return deleted
+
+def delete_orphan_organization_types(organization_type_ids, batch_size=1000):
+    """
+    Delete the organization types of `organization_type_ids` that no entity
+    is linked to anymore, with a DELETE query for every `batch_size`
+    organization types.
+
+    Returns:
+        Amount of organization types deleted.
+    """
+    organization_type_ids = list(organization_type_ids)
+    deleted = 0
+    for i in range(0, len(organization_type_ids), batch_size):
+        batch = organization_type_ids[i:i + batch_size]
+        deleted += raw_delete(
+            OrganizationType.objects.filter(id__in=batch).exclude(
+                id__in=EntityOrganizationType.objects.filter(organization_type_id__in=batch).values('organization_type_id')
+            )
+        )
+    return deleted
+
+def delete_databreaches(queryset, delete_orphans=True, batch_size=1000):
+    """
+    Delete the data breaches of `queryset` with set based queries: one query
+    to find the data breaches and, for every `batch_size` data breaches, one
+    query finding their sources and DELETE queries for their links to sources,
+    the data breaches and the sources no other data breach cites. With
+    `delete_orphans`, the entities left without data breaches are deleted too,
+    along with their links to organization types and the organization types
+    no other entity is linked to, with five more queries for every
+    `batch_size` entities. Must be called in a transaction.
+
+    Args:
+        queryset (QuerySet) : data breaches to delete.
+        delete_orphans (bool) : delete the entities left without data breaches.
+        batch_size (int) : amount of data breaches deleted by each query.
+
+    Returns:
+        Dictionary with the amount of `databreaches`, `sources`, `entities`
+        and `organization_types` deleted.
+    """
+    rows = list(queryset.order_by().values_list('id', 'entity_id'))
+    deleted = {
+        'databreaches' : 0,
+        'sources' : 0,
+        'entities' : 0,
+        'organization_types' : 0,
+    }
+    for i in range(0, len(rows), batch_size):
+        ids = [pk for pk, entity_id in rows[i:i + batch_size]]
+        source_ids = list(
+            DataBreachSource.objects.filter(data_breach_id__in=ids).values_list('source_id', flat=True).distinct()
+        )
+        raw_delete(DataBreachSource.objects.filter(data_breach_id__in=ids))
+        deleted['databreaches'] += raw_delete(DataBreach.objects.filter(id__in=ids))
+        deleted['sources'] += delete_orphan_sources(source_ids, batch_size=batch_size)
+
+    if delete_orphans:
+        entity_ids = list({entity_id for pk, entity_id in rows})
+        for i in range(0, len(entity_ids), batch_size):
+            batch = entity_ids[i:i + batch_size]
+            orphans = list(
+                Entity.objects.filter(id__in=batch).exclude(
+                    id__in=DataBreach.objects.filter(entity_id__in=batch).values('entity_id')
+                ).values_list('id', flat=True)
+            )
+            if orphans:
+                links = EntityOrganizationType.objects.filter(entity_id__in=orphans)
+                organization_type_ids = list(links.values_list('organization_type_id', flat=True).distinct())
+                raw_delete(links)
+                deleted['entities'] += raw_delete(Entity.objects.filter(id__in=orphans))
+                deleted['organization_types'] += delete_orphan_organization_types(
+                    organization_type_ids, batch_size=batch_size
+                )
+
+    if rows:
+        invalidate()
+    return deleted
+
+# fields of the data breaches changed by bulk updates
+UPDATE_FIELDS = ['year', 'records', 'method']
+
+def update_databreaches(changes, batch_size=1000):
+    """
+    Apply partial updates to data breaches by id, with two queries for every
+    `batch_size` data breaches: one reading them and a `bulk_update` writing
+    the changed ones, along with their stored representation. Must be called
+    in a transaction.
+
+    Args:
+        changes (dict) : dictionary mapping data breaches ids to a dictionary
+        with the new values of some of the `UPDATE_FIELDS`.
+        batch_size (int) : amount of data breaches read and written by each query.
+
+    Returns:
+        Dictionary mapping each id to `updated`, `unchanged` or `not_found`.
+    """
+    results = {}
+    ids = list(changes)
+    for i in range(0, len(ids), batch_size):
+        databreaches = DataBreach.objects.filter(id__in=ids[i:i + batch_size]).only(
+            'id', 'representation', *UPDATE_FIELDS
+        ).select_for_update()
+
+        changed = []
+        for databreach in databreaches:
+            values = changes[databreach.id]
+            if all(getattr(databreach, field) == value for field, value in values.items()):
+                results[databreach.id] = 'unchanged'
+                continue
+
+            for field, value in values.items():
+                setattr(databreach, field, value)
+            if databreach.representation is not None:
+                databreach.representation = dict(databreach.representation, **values)
+            changed.append(databreach)
+            results[databreach.id] = 'updated'
+
+        if changed:
+            DataBreach.objects.bulk_update(changed, UPDATE_FIELDS + ['representation'])
+
+    if 'updated' in results.values():
+        # bulk updates do not send signals
+        invalidate()
+    return {pk: results.get(pk, 'not_found') for pk in ids}
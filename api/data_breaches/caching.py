@@ -0,0 +1,180 @@
+import functools
+import hashlib
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import response
+from .models import DatasetVersion
+
+DEFAULTS = {
+    # turn the response cache on or off
+    'ENABLED' : True,
+    # alias of the cache in CACHES used to store responses
+    'ALIAS' : 'default',
+    # seconds a response is kept, None to keep it until the data changes
+    'TIMEOUT' : 300,
+    'KEY_PREFIX' : 'data_breaches',
+    # seconds a verified api key is kept on a shared cache, 0 to verify keys
+    # on every request
+    'API_KEY_TIMEOUT' : 60,
+}
+
+# backends keeping their entries in the memory of each process
+LOCAL_CACHE_BACKENDS = (LocMemCache, DummyCache)
+
+_deferred = threading.local()
+
+def get_setting(name):
+    """Get a setting of the `DATA_BREACHES_CACHE` dict, falling back to `DEFAULTS`."""
+    return getattr(settings, 'DATA_BREACHES_CACHE', {}).get(name, DEFAULTS[name])
+
+def get_cache():
+    return caches[get_setting('ALIAS')]
+
+def is_shared_cache():
+    """Tell if every worker uses the same cache, unlike the local memory cache of each process."""
+    return not isinstance(get_cache(), LOCAL_CACHE_BACKENDS)
+
+def make_key(*parts):
+    return ':'.join([get_setting('KEY_PREFIX')] + [str(p) for p in parts])
+
+def get_version(request=None):
+    """
+    Get the current version of the data breaches data, stored on the
+    DatasetVersion table so every worker agrees on it. Cached responses are
+    stored under the version they were built with, so bumping the version
+    invalidates all of them at once.
+
+    Args:
+        request (Request) : when given, the version is read once per request.
+
+    Returns:
+        Tuple with the version number and the datetime of the last change.
+    """
+    if request is not None and hasattr(request, 'data_breaches_version'):
+        return request.data_breaches_version
+
+    dataset_version = DatasetVersion.objects.filter(pk=1).first()
+    if dataset_version is None:
+        dataset_version, created = DatasetVersion.objects.get_or_create(pk=1)
+    version = (dataset_version.version, dataset_version.updated_at)
+
+    if request is not None:
+        request.data_breaches_version = version
+    return version
+
+def bump_version():
+    """Increment the data version, invalidating every cached response."""
+    updated = DatasetVersion.objects.filter(pk=1).update(
+        version=F('version') + 1,
+        updated_at=timezone.now()
+    )
+    if not updated:
+        DatasetVersion.objects.get_or_create(pk=1)
+
+def invalidate():
+    """
+    Invalidate every cached response, or only mark them to be invalidated when
+    inside `defer_invalidation`.
+    """
+    if getattr(_deferred, 'depth', 0):
+        _deferred.pending = True
+    else:
+        bump_version()
+
+@contextmanager
+def defer_invalidation():
+    """
+    Context manager that invalidates cached responses once when it exits,
+    instead of once for every change made inside it. Use it around writes that
+    change many rows, after their transaction, so responses are not cached
+    with data that is not committed yet.
+    """
+    depth = getattr(_deferred, 'depth', 0)
+    _deferred.depth = depth + 1
+    try:
+        yield
+    finally:
+        _deferred.depth = depth
+        if depth == 0 and getattr(_deferred, 'pending', False):
+            _deferred.pending = False
+            bump_version()
+
+def count(name):
+    """Increment the `hits` or `misses` counter."""
+    cache = get_cache()
+    key = make_key('stats', name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+def get_stats():
+    """
+    Get the response cache counters.
+
+    Returns:
+        Dictionary with the amount of cache `hits` and `misses`.
+    """
+    cache = get_cache()
+    return {
+        name : cache.get(make_key('stats', name), 0)
+        for name in ['hits', 'misses']
+    }
+
+def condition_on_version(view_method):
+    """
+    Decorator for viewset actions adding `ETag` and `Last-Modified` headers
+    built from the data version. Requests with a matching `If-None-Match` or
+    `If-Modified-Since` header get a 304 response before the view runs, so no
+    data breach is fetched or serialized.
+    """
+    @functools.wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        version, updated_at = get_version(request)
+        etag = 'W/"%d"' % version
+        last_modified = int(updated_at.timestamp())
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        resp = not_modified or view_method(view, request, *args, **kwargs)
+        if resp.status_code in (200, 304):
+            resp['ETag'] = etag
+            resp['Last-Modified'] = http_date(last_modified)
+        return resp
+    return wrapper
+
+def cache_response(view_method):
+    """
+    Decorator for viewset actions caching the data of successful responses,
+    keyed on the full path of the request (query string included) and the
+    data version. Responses carry a `X-Cache` header telling if they came
+    from the cache.
+    """
+    @functools.wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        if not get_setting('ENABLED'):
+            return view_method(view, request, *args, **kwargs)
+
+        cache = get_cache()
+        version, updated_at = get_version(request)
+        path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+        key = make_key('response', version, path)
+        data = cache.get(key)
+        if data is not None:
+            count('hits')
+            return response.Response(data, headers={'X-Cache' : 'HIT'})
+
+        count('misses')
+        resp = view_method(view, request, *args, **kwargs)
+        if resp.status_code == 200:
+            cache.set(key, resp.data, get_setting('TIMEOUT'))
+        resp['X-Cache'] = 'MISS'
+        return resp
+    return wrapper
@@ -0,0 +1,40 @@
+import django_filters
+from .models import *
+from .search import search_databreaches
+
+class DataBreachFilter(django_filters.FilterSet):
+    """
+    Filters available on the data breaches list. Every filter is backed by a
+    database index.
+
+    Filters:
+        * year, year__gte, year__lte : year of the data breach.
+        * method : method used in the breaching process.
+        * records__gte, records__lte : range of compromised records.
+        * entity : name of the entity involved.
+        * organization_type : sphere of action of the entity involved.
+        * source : url of a source citing the data breach.
+        * search : words starting the entity name or a source url, see `search`.
+
+    Example:
+
+    ```code
+    /api/databreaches/?year__gte=2015&method=hacked&organization_type=web
+    /api/databreaches/?search=yaho
+    ```
+    """
+    entity = django_filters.CharFilter(field_name='entity__name')
+    organization_type = django_filters.CharFilter(field_name='entity__organization_types__organization_type')
+    source = django_filters.CharFilter(field_name='sources__url')
+    search = django_filters.CharFilter(method='filter_search')
+
+    class Meta:
+        model = DataBreach
+        fields = {
+            'year' : ['exact', 'gte', 'lte'],
+            'method' : ['exact'],
+            'records' : ['gte', 'lte'],
+        }
+
+    def filter_search(self, queryset, name, value):
+        return search_databreaches(queryset, value)
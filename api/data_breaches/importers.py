@@ -0,0 +1,516 @@
+import itertools
+import json
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from .bulk import delete_databreaches, delete_orphan_sources, raw_delete
+from .caching import defer_invalidation, invalidate
+from .models import *
+from .representations import make_representation, refresh_representations
+
+# amount of characters read from a json file at a time
+CHUNK_SIZE = 64 * 1024
+# longest token that can fail to decode because it is cut: a literal like
+# -Infinity or an escape like \uXXXX
+TRUNCATED_TAIL = len('-Infinity')
+
+def detect_format(jsonf):
+    """
+    Detect if a file holds a json array of data breaches or one data breach
+    per line (NDJSON), looking at its first character.
+
+    Args:
+        jsonf (file) : seekable text file.
+
+    Returns:
+        'json' or 'ndjson'.
+    """
+    char = jsonf.read(1)
+    while char.isspace():
+        char = jsonf.read(1)
+    jsonf.seek(0)
+    return 'json' if char == '[' else 'ndjson'
+
+def iter_ndjson(jsonf):
+    """Yield the json objects of a file with one object per line, skipping blank lines."""
+    for line in jsonf:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def iter_json_array(jsonf, chunk_size=CHUNK_SIZE):
+    """
+    Yield the items of a top level json array, parsing the file incrementally
+    so only the item being parsed is kept in memory.
+
+    Args:
+        jsonf (file) : text file containing a json array.
+        chunk_size (int) : amount of characters read at a time.
+
+    Raises:
+        ValueError : if the file does not contain a valid json array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    started = False
+    expect_item = True
+    items = 0
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+
+        if pos == len(buffer):
+            chunk = jsonf.read(chunk_size)
+            if not chunk:
+                raise ValueError('Unexpected end of file, the json array is not closed.')
+            buffer, pos = chunk, 0
+            continue
+
+        char = buffer[pos]
+        if not started:
+            if char != '[':
+                raise ValueError('Expected a json array.')
+            started = True
+            pos += 1
+        elif char == ']':
+            if expect_item and items:
+                raise ValueError('Trailing "," at the end of the json array.')
+            return
+        elif char == ',' and not expect_item:
+            expect_item = True
+            pos += 1
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # an item cut at the end of the buffer fails on its last
+                # characters or on a string left open, any other error is
+                # raised without reading the rest of the file
+                if e.pos < len(buffer) - TRUNCATED_TAIL and not e.msg.startswith('Unterminated string'):
+                    raise
+                end = None
+
+            # the item may be cut at the end of the buffer, read more and try again
+            if end is None or end == len(buffer):
+                chunk = jsonf.read(chunk_size)
+                if chunk:
+                    buffer, pos = buffer[pos:] + chunk, 0
+                    continue
+                if end is None:
+                    decoder.raw_decode(buffer, pos)
+
+            if not expect_item:
+                raise ValueError('Expected "," or "]" between the items of the json array.')
+            yield item
+            items += 1
+            pos = end
+            expect_item = False
+
+def iter_databreaches(jsonf, file_format='auto'):
+    """
+    Yield the data breaches of a json array or NDJSON file without loading the
+    whole file in memory.
+
+    Args:
+        jsonf (file) : text file with data breaches data.
+        file_format (str) : 'json', 'ndjson' or 'auto' to detect it from the file.
+    """
+    if file_format == 'auto':
+        file_format = detect_format(jsonf)
+    if file_format == 'json':
+        return iter_json_array(jsonf)
+    return iter_ndjson(jsonf)
+
+def batched(iterable, size):
+    """Yield lists with `size` items of `iterable`, the last one may be smaller."""
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
+
+def clean_url(url):
+    """
+    Check a source url the way the database stores it. Urls are not checked
+    against `URLValidator`, same as the records imported one by one.
+
+    Raises:
+        ValidationError : if the url is too long.
+    """
+    url = str(url)
+    max_length = Source._meta.get_field('url').max_length
+    if len(url) > max_length:
+        raise ValidationError('Ensure this url has at most %d characters.' % max_length)
+    return url
+
+def clean_databreach(data):
+    """
+    Validate the raw data of a data breach, as found on the scraper json file,
+    using the validation of the model fields.
+
+    Args:
+        data (dict) : data breach data with `entity`, `year`, `records`, `method`
+        and `sources`.
+
+    Returns:
+        Dictionary with the cleaned data breach data.
+
+    Raises:
+        ValidationError, KeyError, TypeError : if the data is not valid.
+    """
+    entity_data = data['entity']
+    return {
+        'entity' : {
+            'name' : Entity._meta.get_field('name').clean(entity_data['name'], None),
+            'organization_type' : [
+                OrganizationType._meta.get_field('organization_type').clean(t, None)
+                for t in entity_data.get('organization_type', [])
+            ]
+        },
+        'year' : DataBreach._meta.get_field('year').clean(data['year'], None),
+        'records' : DataBreach._meta.get_field('records').clean(data['records'], None),
+        'method' : DataBreach._meta.get_field('method').clean(data['method'], None),
+        # a data breach cites each url once
+        'sources' : list(dict.fromkeys(
+            clean_url(url)
+            for url in data.get('sources', [])
+        ))
+    }
+
+class BulkImporter:
+    """
+    Import data breaches in batches with set based queries.
+
+    Every batch is loaded in a single transaction: entities are resolved with
+    one query, the missing ones and the organization types are created with
+    `bulk_create` and so are data breaches and sources. If the database refuses
+    a batch, it is loaded again record by record so only the faulty records
+    are left out.
+
+    Attributes:
+        on_error (callable) : called with the raw data and the exception of every
+        record that could not be imported.
+        created (int) : amount of data breaches imported.
+        failed (int) : amount of data breaches that could not be imported.
+    """
+    def __init__(self, on_error=None):
+        self.on_error = on_error
+        self.created = 0
+        self.failed = 0
+
+    def load(self, records):
+        """
+        Import a batch of data breaches.
+
+        Args:
+            records (list) : list of data breaches raw data.
+
+        Returns:
+            List of created DataBreach objects.
+        """
+        batch = []
+        for data in records:
+            try:
+                batch.append((data, clean_databreach(data)))
+            except (ValidationError, KeyError, TypeError, AttributeError) as e:
+                self.report_error(data, e)
+
+        if not batch:
+            return []
+
+        with defer_invalidation():
+            try:
+                with transaction.atomic():
+                    databreaches = self.write([cleaned for data, cleaned in batch])
+            except DatabaseError:
+                databreaches = []
+                for data, cleaned in batch:
+                    try:
+                        with transaction.atomic():
+                            databreaches += self.write([cleaned])
+                    except DatabaseError as e:
+                        self.report_error(data, e)
+
+            # bulk inserts do not send signals
+            invalidate()
+        return databreaches
+
+    def write(self, batch):
+        """
+        Write a batch of cleaned data breaches to the database. Called inside a
+        transaction.
+
+        Returns:
+            List of created DataBreach objects.
+        """
+        databreaches = self.create(batch)
+        self.created += len(databreaches)
+        return databreaches
+
+    def report_error(self, data, error):
+        self.failed += 1
+        if self.on_error is not None:
+            self.on_error(data, error)
+
+    def create(self, batch):
+        """
+        Create entities, organization types, data breaches and sources of
+        already cleaned data breaches.
+
+        Args:
+            batch (list) : list of cleaned data breaches data.
+
+        Returns:
+            List of created DataBreach objects.
+        """
+        if not batch:
+            return []
+
+        entities = self.resolve_entities({data['entity']['name'] for data in batch})
+        org_types = self.create_organization_types(entities, batch)
+
+        databreaches = DataBreach.objects.bulk_create([
+            DataBreach(
+                entity_id=entities[data['entity']['name']].id,
+                year=data['year'],
+                records=data['records'],
+                method=data['method'],
+                representation=make_representation(
+                    data['entity']['name'],
+                    org_types[entities[data['entity']['name']].id],
+                    data['year'],
+                    data['records'],
+                    data['method'],
+                    data['sources']
+                )
+            )
+            for data in batch
+        ])
+
+        source_ids = self.resolve_sources({url for data in batch for url in data['sources']})
+        DataBreachSource.objects.bulk_create([
+            DataBreachSource(data_breach_id=databreach.id, source_id=source_ids[url])
+            for data, databreach in zip(batch, databreaches)
+            for url in data['sources']
+        ])
+        return databreaches
+
+    def create_organization_types(self, entities, batch):
+        """
+        Link the batch entities to the organization types they are not linked
+        to yet, creating the missing organization types. The representations
+        of the existing data breaches of the entities that got new organization
+        types are refreshed.
+
+        Args:
+            entities (dict) : Entity objects of the batch by name.
+            batch (list) : list of cleaned data breaches data.
+
+        Returns:
+            Dictionary mapping the id of each entity to the list of its
+            organization types.
+        """
+        entity_ids = {entities[data['entity']['name']].id for data in batch}
+        org_types = {entity_id: [] for entity_id in entity_ids}
+        links = EntityOrganizationType.objects.filter(entity_id__in=entity_ids).order_by('id').values_list(
+            'entity_id', 'organization_type__organization_type'
+        )
+        for entity_id, t in links:
+            org_types[entity_id].append(t)
+
+        # dict keeps the organization types in the order they were given
+        new = dict.fromkeys(
+            (entities[data['entity']['name']].id, t)
+            for data in batch
+            for t in data['entity']['organization_type']
+            if t not in org_types[entities[data['entity']['name']].id]
+        )
+        if not new:
+            return org_types
+
+        type_ids = self.resolve_organization_types({t for entity_id, t in new})
+        EntityOrganizationType.objects.bulk_create(
+            [EntityOrganizationType(entity_id=entity_id, organization_type_id=type_ids[t]) for entity_id, t in new],
+            ignore_conflicts=True
+        )
+        for entity_id, t in new:
+            org_types[entity_id].append(t)
+        refresh_representations(DataBreach.objects.filter(entity_id__in={entity_id for entity_id, t in new}))
+        return org_types
+
+    def resolve_organization_types(self, names):
+        """
+        Get the ids of the organization types with the given names, creating
+        the missing ones.
+
+        Args:
+            names (set) : set of organization type names.
+
+        Returns:
+            Dictionary mapping each name to its OrganizationType id.
+        """
+        type_ids = dict(OrganizationType.objects.filter(organization_type__in=names).values_list('organization_type', 'id'))
+        missing = names - type_ids.keys()
+        if missing:
+            OrganizationType.objects.bulk_create(
+                [OrganizationType(organization_type=name) for name in missing],
+                ignore_conflicts=True
+            )
+            type_ids.update(OrganizationType.objects.filter(organization_type__in=missing).values_list('organization_type', 'id'))
+        return type_ids
+
+    def resolve_sources(self, urls, batch_size=1000):
+        """
+        Get the ids of the sources with the given urls, creating the missing
+        ones, with at most three queries for every `batch_size` urls.
+
+        Args:
+            urls (set) : set of source urls.
+
+        Returns:
+            Dictionary mapping each url to its Source id.
+        """
+        source_ids = {}
+        for batch in batched(urls, batch_size):
+            found = dict(Source.objects.filter(url__in=batch).values_list('url', 'id'))
+            missing = [url for url in batch if url not in found]
+            if missing:
+                Source.objects.bulk_create([Source(url=url) for url in missing], ignore_conflicts=True)
+                found.update(Source.objects.filter(url__in=missing).values_list('url', 'id'))
+            source_ids.update(found)
+        return source_ids
+
+    def resolve_entities(self, names):
+        """
+        Get the entities with the given names, creating the missing ones.
+
+        Args:
+            names (set) : set of entity names.
+
+        Returns:
+            Dictionary mapping each name to its Entity object.
+        """
+        entities = {e.name: e for e in Entity.objects.filter(name__in=names)}
+        missing = names - entities.keys()
+        if missing:
+            Entity.objects.bulk_create([Entity(name=name) for name in missing], ignore_conflicts=True)
+            entities.update({e.name: e for e in Entity.objects.filter(name__in=missing)})
+        return entities
+
+def natural_key(data):
+    """
+    Key identifying a data breach between scraper runs: its entity name, year,
+    method and amount of records.
+    """
+    return (data['entity']['name'], data['year'], data['method'], data['records'])
+
+class SyncImporter(BulkImporter):
+    """
+    Synchronize the database with a scraper dump instead of inserting every
+    data breach again.
+
+    Data breaches are matched to the existing ones by `natural_key`. Matched data
+    breaches whose sources changed get their sources replaced, the new ones are
+    created and, when `delete` is set, the existing data breaches missing from
+    the dump are removed by `finish`. Organization types found in the dump are
+    added to the entities. Every write is set based, so a refresh only touches
+    the data breaches that changed.
+
+    Attributes:
+        delete (bool) : delete the data breaches missing from the dump on `finish`.
+        updated (int) : amount of data breaches whose sources were replaced.
+        unchanged (int) : amount of data breaches already up to date.
+        deleted (int) : amount of data breaches deleted.
+        seen (set) : ids of the data breaches found in the dump, matched or created.
+    """
+    def __init__(self, on_error=None, delete=False):
+        super().__init__(on_error=on_error)
+        self.delete = delete
+        self.updated = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self.seen = set()
+
+    def write(self, batch):
+        # existing data breaches of the entities in the batch, by natural key.
+        # Data breaches already matched by previous batches are left out so
+        # duplicated data breaches are matched one to one.
+        existing = {}
+        rows = DataBreach.objects.filter(
+            entity__name__in={data['entity']['name'] for data in batch}
+        ).order_by('id').values_list('id', 'entity__name', 'year', 'method', 'records')
+        for row in rows:
+            if row[0] not in self.seen:
+                existing.setdefault(row[1:], []).append(row[0])
+
+        new = []
+        matched = {}
+        for data in batch:
+            ids = existing.get(natural_key(data))
+            if ids:
+                matched[ids.pop(0)] = data
+            else:
+                new.append(data)
+
+        current_sources = {pk: [] for pk in matched}
+        links = DataBreachSource.objects.filter(data_breach_id__in=matched.keys()).values_list(
+            'data_breach_id', 'source__url', 'source_id'
+        )
+        unlinked = set()
+        for pk, url, source_id in links:
+            current_sources[pk].append(url)
+            unlinked.add((pk, source_id))
+        changed = {
+            pk: data for pk, data in matched.items()
+            if sorted(current_sources[pk]) != sorted(data['sources'])
+        }
+
+        if changed:
+            raw_delete(DataBreachSource.objects.filter(data_breach_id__in=changed.keys()))
+            source_ids = self.resolve_sources({url for data in changed.values() for url in data['sources']})
+            DataBreachSource.objects.bulk_create([
+                DataBreachSource(data_breach_id=pk, source_id=source_ids[url])
+                for pk, data in changed.items()
+                for url in data['sources']
+            ])
+            # sources no data breach cites anymore
+            delete_orphan_sources({source_id for pk, source_id in unlinked if pk in changed})
+
+        matched_data = list(matched.values())
+        if matched_data:
+            entities = self.resolve_entities({data['entity']['name'] for data in matched_data})
+            self.create_organization_types(entities, matched_data)
+
+        if changed:
+            refresh_representations(DataBreach.objects.filter(id__in=changed.keys()))
+
+        databreaches = self.create(new)
+
+        # created data breaches are seen too, so `finish` keeps them and later
+        # duplicates do not match them, whatever the batch boundaries
+        self.seen.update(matched)
+        self.seen.update(databreach.id for databreach in databreaches)
+        self.created += len(databreaches)
+        self.updated += len(changed)
+        self.unchanged += len(matched) - len(changed)
+        return databreaches
+
+    def finish(self, batch_size=1000):
+        """
+        Delete the existing data breaches, and their sources, that were not
+        found in the dump when `delete` is set. Must be called after every batch
+        of the dump was loaded. Nothing is deleted if some data breaches of the
+        dump could not be loaded, as they may match existing data breaches.
+        """
+        if not self.delete or self.failed:
+            return
+        vanished = [
+            pk for pk in DataBreach.objects.order_by('id').values_list('id', flat=True).iterator()
+            if pk not in self.seen
+        ]
+        with defer_invalidation():
+            with transaction.atomic():
+                for ids in batched(vanished, batch_size):
+                    self.deleted += delete_databreaches(
+                        DataBreach.objects.filter(id__in=ids), delete_orphans=False, batch_size=batch_size
+                    )['databreaches']
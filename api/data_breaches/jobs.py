@@ -0,0 +1,112 @@
+import io
+from django.utils import timezone
+from .importers import BulkImporter, batched, iter_databreaches
+from .models import ImportJob
+
+# amount of errors of data breaches that could not be imported kept by a job
+MAX_ERRORS = 100
+
+def claim_job():
+    """
+    Mark the oldest pending import job as running, so no other worker picks
+    it, and return it.
+
+    Returns:
+        The ImportJob, or None when there are no pending jobs.
+    """
+    while True:
+        pk = ImportJob.objects.filter(status=ImportJob.PENDING).order_by('id').values_list('id', flat=True).first()
+        if pk is None:
+            return None
+        claimed = ImportJob.objects.filter(pk=pk, status=ImportJob.PENDING).update(
+            status=ImportJob.RUNNING, started_at=timezone.now()
+        )
+        # another worker may have picked the job first
+        if claimed:
+            return ImportJob.objects.get(pk=pk)
+
+def fail_stale_jobs():
+    """
+    Mark the jobs left running by a worker that stopped as `failed`. They are
+    not run again, as the batches already imported would be imported twice.
+    Call it when the only worker starts.
+
+    Returns:
+        Amount of jobs marked as failed.
+    """
+    return ImportJob.objects.filter(status=ImportJob.RUNNING).update(
+        status=ImportJob.FAILED,
+        error='The worker stopped before the job was over.',
+        payload='',
+        finished_at=timezone.now()
+    )
+
+class PayloadError(Exception):
+    """The payload of an import job is not valid json."""
+
+def read_batches(job):
+    """
+    Read the data breaches of the payload of a job, `batch_size` at a time.
+    Only the errors of the json parser are raised as `PayloadError`, so they
+    are not mistaken for the errors of the import.
+
+    Args:
+        job (ImportJob) : job whose payload is read.
+
+    Yields:
+        Lists of dictionaries of data breaches.
+    """
+    batches = batched(iter_databreaches(io.StringIO(job.payload)), job.batch_size)
+    while True:
+        try:
+            batch = next(batches)
+        except StopIteration:
+            return
+        except ValueError as e:
+            raise PayloadError(e) from e
+        yield batch
+
+def run_job(job):
+    """
+    Import the payload of a running job with `BulkImporter`, `batch_size`
+    data breaches at a time, saving the progress of the job after every batch.
+    Each batch invalidates the cached responses once it is committed. The
+    payload is cleared once the job is over, the job is `failed` when the
+    payload is not valid json or the import stops on any other error.
+
+    Args:
+        job (ImportJob) : job claimed with `claim_job`.
+
+    Returns:
+        The finished job.
+    """
+    # position in the payload of the data breaches of the batch being loaded
+    positions = {}
+
+    def report_error(data, error):
+        if len(job.errors) < MAX_ERRORS:
+            job.errors.append({'index' : positions.get(id(data)), 'error' : str(error)})
+
+    importer = BulkImporter(on_error=report_error)
+    try:
+        for batch in read_batches(job):
+            positions.clear()
+            positions.update((id(data), job.processed + i) for i, data in enumerate(batch))
+            importer.load(batch)
+            job.processed += len(batch)
+            job.created, job.failed = importer.created, importer.failed
+            job.save(update_fields=['processed', 'created', 'failed', 'errors'])
+        job.status = ImportJob.DONE
+    except PayloadError as e:
+        job.status = ImportJob.FAILED
+        job.error = 'Not possible to read the payload: ' + str(e)
+    except Exception as e:
+        # the worker goes on with the next jobs
+        job.status = ImportJob.FAILED
+        job.error = 'The import stopped: %s: %s' % (type(e).__name__, e)
+
+    job.created, job.failed = importer.created, importer.failed
+    job.payload = ''
+    job.finished_at = timezone.now()
+    job.save()
+    return job
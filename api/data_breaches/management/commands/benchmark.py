@@ -0,0 +1,114 @@
+import inspect
+import json
+import platform
+import subprocess
+import django
+from data_breaches.benchmarks import SUITES
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+def find_measures(results, path=()):
+    """Yield the path and value of every measure, the dicts with `us_per_call`, in `results`."""
+    for name, value in results.items():
+        if isinstance(value, dict):
+            if 'us_per_call' in value:
+                yield path + (name,), value
+            else:
+                yield from find_measures(value, path + (name,))
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Command(BaseCommand):
+    help = "Run performance benchmarks on a temporary database and report the results as json."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'suites',
+            nargs='*',
+            help="Benchmarks to run, all of them by default: %s." % ', '.join(SUITES)
+        )
+        parser.add_argument('--repeat', type=int, help="Amount of calls measured by each benchmark, each one has its own default.")
+        parser.add_argument(
+            '--size',
+            type=int,
+            help="Amount of generated data breaches used by the benchmarks working on a dataset (10000 by default)."
+        )
+        parser.add_argument('--output', type=str, help="Path of a json file to write the results to.")
+        parser.add_argument('--compare', type=str, help="Path of the json results of a previous run to compare the results with.")
+
+    def handle(self, *args, **options):
+        suites = options['suites'] or list(SUITES)
+        unknown = [suite for suite in suites if suite not in SUITES]
+        if unknown:
+            raise CommandError("Unknown benchmarks: %s. Choose from %s." % (', '.join(unknown), ', '.join(SUITES)))
+        if options['repeat'] is not None and options['repeat'] < 1:
+            raise CommandError("--repeat must be a positive number.")
+        if options['size'] is not None and options['size'] < 1:
+            raise CommandError("--size must be a positive number.")
+
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+
+        # run on a test database so the data of the project is not touched,
+        # without DEBUG so queries are not logged, like in production
+        setup_test_environment(debug=False)
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = {}
+            for suite in suites:
+                kwargs = {}
+                if options['repeat'] is not None:
+                    kwargs['repeat'] = options['repeat']
+                if options['size'] is not None and 'size' in inspect.signature(SUITES[suite]).parameters:
+                    kwargs['size'] = options['size']
+                results[suite] = SUITES[suite](**kwargs)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps({
+            'meta' : {
+                'date' : timezone.now().isoformat(),
+                'commit' : git_commit(),
+                'size' : options['size'],
+                'python' : platform.python_version(),
+                'django' : django.get_version(),
+                'database' : connection.vendor,
+            },
+            'results' : results,
+        }, indent=4)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+        if previous is not None:
+            self.compare(previous.get('results', {}), results)
+
+    def compare(self, previous, results):
+        """Write the change of time and queries per call of every measure found in both results."""
+        previous_measures = dict(find_measures(previous))
+        for path, measure in find_measures(results):
+            old = previous_measures.get(path)
+            if old is None:
+                continue
+            self.stdout.write("%s: %.1fus -> %.1fus (x%.2f), %.1f -> %.1f queries" % (
+                '.'.join(path),
+                old['us_per_call'],
+                measure['us_per_call'],
+                measure['us_per_call'] / old['us_per_call'] if old['us_per_call'] else 0,
+                old['queries_per_call'],
+                measure['queries_per_call'],
+            ))
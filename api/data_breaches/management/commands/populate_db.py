@@ -1,5 +1,8 @@
 import argparse
-import json
+import time
+from data_breaches.caching import defer_invalidation
+from data_breaches.importers import BulkImporter, SyncImporter, batched, iter_databreaches
+from data_breaches.representations import refresh_representations, save_representation
 from data_breaches.serializers import *
 from django.core.management.base import BaseCommand, CommandError
 
@@ -8,40 +11,143 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('json_path', type=str, help="Path to the json file with data breaches data.")
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help="Load data breaches in batches with bulk inserts, one transaction per batch."
+        )
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help=(
+                "Synchronize the database with the file: create the new data breaches and replace "
+                "the sources of the changed ones instead of inserting every data breach again. "
+                "Data breaches are matched by entity, year, method and records."
+            )
+        )
+        parser.add_argument(
+            '--delete',
+            action='store_true',
+            help="With --sync, delete the data breaches that are not in the file."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Amount of data breaches read from the file and loaded at a time."
+        )
+        parser.add_argument(
+            '--format',
+            choices=['auto', 'json', 'ndjson'],
+            default='auto',
+            help="Format of the file: a json array or one json data breach per line (ndjson). Detected by default."
+        )
 
     def handle(self, *args, **options):
         json_path = options['json_path']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be a positive number.")
+
+        if options['delete'] and not options['sync']:
+            raise CommandError("--delete can only be used with --sync.")
+
+        if options['sync']:
+            importer = SyncImporter(on_error=self.report_error, delete=options['delete'])
+        else:
+            importer = BulkImporter(on_error=self.report_error)
+        bulk = options['bulk'] or options['sync']
+        load = importer.load if bulk else self.load
+        self.created = 0
+        self.failed = 0
+
+        start = time.perf_counter()
         with open(json_path, 'r') as jsonf:
-            data = json.load(jsonf)
-            for databreach in data:
-                try:
-                    entity_data = databreach.pop('entity')
-                    sources_data = databreach.pop('sources')
-
-                    entity, created = Entity.objects.get_or_create(name=entity_data['name'])
-                    if created:
-                        entity.save()
-
-                    for t in entity_data['organization_type']:
-                        ot_data = {
-                            'organization_type': t,
-                            'entity': entity.id
-                        }
-                        ot, created = OrganizationType.objects.get_or_create(organization_type=t, entity=entity)
-                        if created:
-                            ot.save()
-
-                    dtbreach = DataBreach(
-                        year=databreach['year'],
-                        records=databreach['records'],
-                        method=databreach['method'],
-                        entity=entity
-                    )
-                    dtbreach.save()
-
-                    for s in sources_data:
-                        source = Source(url=s, data_breach=dtbreach)
-                        source.save()
-                except Exception as e:
-                    print("Not possible to register databreach "+str(databreach)+
-                          " Error: "+str(e))
+            try:
+                for batch in batched(iter_databreaches(jsonf, options['format']), batch_size):
+                    # invalidate once the batch is loaded, so responses show
+                    # the data already imported while the import goes on
+                    with defer_invalidation():
+                        load(batch)
+                    if bulk:
+                        self.created, self.failed = importer.created, importer.failed
+                    if options['verbosity'] > 0:
+                        self.report_progress(start)
+            except ValueError as e:
+                raise CommandError("Not possible to read " + json_path + " Error: " + str(e))
+
+        if options['sync']:
+            if options['delete'] and importer.failed:
+                self.stdout.write("Some data breaches could not be loaded, skipping the deletion of missing data breaches.")
+            importer.finish()
+            self.stdout.write(
+                "Synced: %d created, %d updated, %d unchanged, %d deleted." % (
+                    importer.created,
+                    importer.updated,
+                    importer.unchanged,
+                    importer.deleted
+                )
+            )
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            "Imported %d data breaches (%d failed) in %.2fs, %.0f rows/s." % (
+                self.created,
+                self.failed,
+                elapsed,
+                self.created / elapsed if elapsed else 0
+            )
+        )
+
+    def report_error(self, databreach, error):
+        self.stdout.write("Not possible to register databreach "+str(databreach)+
+                          " Error: "+str(error))
+
+    def report_progress(self, start):
+        """Write the amount of data breaches loaded so far and the import rate."""
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            "Loaded %d data breaches (%d failed), %.0f rows/s..." % (
+                self.created,
+                self.failed,
+                self.created / elapsed if elapsed else 0
+            )
+        )
+
+    def load(self, data):
+        """Load data breaches one by one, storing their representation."""
+        for databreach in data:
+            try:
+                entity_data = databreach.pop('entity')
+                sources_data = databreach.pop('sources')
+
+                entity, created = Entity.objects.get_or_create(name=entity_data['name'])
+                if created:
+                    entity.save()
+
+                linked = False
+                for t in entity_data['organization_type']:
+                    ot, created = OrganizationType.objects.get_or_create(organization_type=t)
+                    link, created = EntityOrganizationType.objects.get_or_create(entity=entity, organization_type=ot)
+                    linked = linked or created
+
+                dtbreach = DataBreach(
+                    year=databreach['year'],
+                    records=databreach['records'],
+                    method=databreach['method'],
+                    entity=entity
+                )
+                dtbreach.save()
+
+                for s in sources_data:
+                    source, created = Source.objects.get_or_create(url=s)
+                    DataBreachSource.objects.get_or_create(data_breach=dtbreach, source=source)
+                save_representation(dtbreach)
+                if linked:
+                    # new organization types cleared the representations of
+                    # the other data breaches of the entity
+                    refresh_representations(DataBreach.objects.filter(entity=entity).exclude(pk=dtbreach.pk))
+                self.created += 1
+            except Exception as e:
+                self.failed += 1
+                self.report_error(databreach, e)
@@ -0,0 +1,40 @@
+import time
+from data_breaches.caching import invalidate
+from data_breaches.models import DataBreach
+from data_breaches.representations import refresh_representations
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+class Command(BaseCommand):
+    help = "Rebuild the representation stored on every data breach from its entity, organization types and sources."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            help="Only build the representation of the data breaches that do not have one."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Amount of data breaches read and written at a time."
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be a positive number.")
+
+        queryset = DataBreach.objects.all()
+        if options['missing']:
+            queryset = queryset.filter(representation__isnull=True)
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            refreshed = refresh_representations(queryset, batch_size=batch_size)
+        if refreshed:
+            # bulk updates do not send signals
+            invalidate()
+        elapsed = time.perf_counter() - start
+        self.stdout.write("Rebuilt %d data breaches representations in %.2fs." % (refreshed, elapsed))
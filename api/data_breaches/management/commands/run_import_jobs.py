@@ -0,0 +1,52 @@
+import time
+from data_breaches.jobs import claim_job, fail_stale_jobs, run_job
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = (
+        "Process the data breaches import jobs sent to /api/imports, one at a time, in the background. "
+        "Run a single worker: the jobs left running are marked as failed when it starts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Process the pending jobs and exit instead of waiting for new ones."
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help="Seconds to wait before looking for new jobs when there are none."
+        )
+
+    def handle(self, *args, **options):
+        if options['interval'] <= 0:
+            raise CommandError("--interval must be a positive number.")
+
+        stale = fail_stale_jobs()
+        if stale and options['verbosity'] > 0:
+            self.stdout.write("Marked %d import jobs left running by a stopped worker as failed." % stale)
+
+        while True:
+            job = claim_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            job = run_job(job)
+            if options['verbosity'] > 0:
+                self.stdout.write(
+                    "Import job %d %s: %d data breaches imported (%d failed) in %.2fs, %.0f rows/s.%s" % (
+                        job.id,
+                        job.status,
+                        job.created,
+                        job.failed,
+                        (job.finished_at - job.started_at).total_seconds(),
+                        job.throughput(),
+                        ' ' + job.error if job.error else ''
+                    )
+                )
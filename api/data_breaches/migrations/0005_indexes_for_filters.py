@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:41
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_breaches', '0004_auto_20210928_1339'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='databreach',
+            name='method',
+            field=models.CharField(db_index=True, max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='databreach',
+            name='records',
+            field=models.PositiveIntegerField(db_index=True, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AlterField(
+            model_name='databreach',
+            name='year',
+            field=models.PositiveSmallIntegerField(db_index=True, validators=[django.core.validators.MinValueValidator(1970)]),
+        ),
+        migrations.AlterField(
+            model_name='organizationtype',
+            name='organization_type',
+            field=models.CharField(db_index=True, max_length=30),
+        ),
+    ]
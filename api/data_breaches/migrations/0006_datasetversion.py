@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    DatasetVersion = apps.get_model('data_breaches', 'DatasetVersion')
+    DatasetVersion.objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_breaches', '0005_indexes_for_filters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+def build_representations(apps, schema_editor):
+    DataBreach = apps.get_model('data_breaches', 'DataBreach')
+    queryset = DataBreach.objects.select_related('entity').prefetch_related(
+        'entity__organizationtype_set',
+        'databreach'
+    ).order_by('id')
+
+    batch = []
+    for databreach in queryset.iterator(chunk_size=1000):
+        databreach.representation = {
+            'entity' : {
+                'name' : databreach.entity.name,
+                'organization_type' : [
+                    org.organization_type for org in databreach.entity.organizationtype_set.all()
+                ]
+            },
+            'year' : databreach.year,
+            'records' : databreach.records,
+            'method' : databreach.method,
+            'sources' : [s.url for s in databreach.databreach.all()]
+        }
+        batch.append(databreach)
+        if len(batch) == 1000:
+            DataBreach.objects.bulk_update(batch, ['representation'])
+            batch = []
+    DataBreach.objects.bulk_update(batch, ['representation'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_breaches', '0006_datasetversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='databreach',
+            name='representation',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(build_representations, migrations.RunPython.noop),
+    ]
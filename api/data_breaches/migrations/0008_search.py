@@ -0,0 +1,102 @@
+from django.db import migrations
+
+# FTS5 tables with external content indexing entity names and source urls,
+# kept in sync with the base tables by triggers. Prefix indexes make the
+# autocomplete prefix queries a single index lookup.
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE data_breaches_entity_fts USING fts5(
+        name,
+        content='data_breaches_entity',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='1 2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER data_breaches_entity_fts_insert AFTER INSERT ON data_breaches_entity BEGIN
+        INSERT INTO data_breaches_entity_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    """
+    CREATE TRIGGER data_breaches_entity_fts_delete AFTER DELETE ON data_breaches_entity BEGIN
+        INSERT INTO data_breaches_entity_fts(data_breaches_entity_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END
+    """,
+    """
+    CREATE TRIGGER data_breaches_entity_fts_update AFTER UPDATE ON data_breaches_entity BEGIN
+        INSERT INTO data_breaches_entity_fts(data_breaches_entity_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO data_breaches_entity_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    "INSERT INTO data_breaches_entity_fts(data_breaches_entity_fts) VALUES ('rebuild')",
+    """
+    CREATE VIRTUAL TABLE data_breaches_source_fts USING fts5(
+        url,
+        content='data_breaches_source',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER data_breaches_source_fts_insert AFTER INSERT ON data_breaches_source BEGIN
+        INSERT INTO data_breaches_source_fts(rowid, url) VALUES (new.id, new.url);
+    END
+    """,
+    """
+    CREATE TRIGGER data_breaches_source_fts_delete AFTER DELETE ON data_breaches_source BEGIN
+        INSERT INTO data_breaches_source_fts(data_breaches_source_fts, rowid, url) VALUES ('delete', old.id, old.url);
+    END
+    """,
+    """
+    CREATE TRIGGER data_breaches_source_fts_update AFTER UPDATE ON data_breaches_source BEGIN
+        INSERT INTO data_breaches_source_fts(data_breaches_source_fts, rowid, url) VALUES ('delete', old.id, old.url);
+        INSERT INTO data_breaches_source_fts(rowid, url) VALUES (new.id, new.url);
+    END
+    """,
+    "INSERT INTO data_breaches_source_fts(data_breaches_source_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS data_breaches_entity_fts_insert",
+    "DROP TRIGGER IF EXISTS data_breaches_entity_fts_delete",
+    "DROP TRIGGER IF EXISTS data_breaches_entity_fts_update",
+    "DROP TABLE IF EXISTS data_breaches_entity_fts",
+    "DROP TRIGGER IF EXISTS data_breaches_source_fts_insert",
+    "DROP TRIGGER IF EXISTS data_breaches_source_fts_delete",
+    "DROP TRIGGER IF EXISTS data_breaches_source_fts_update",
+    "DROP TABLE IF EXISTS data_breaches_source_fts",
+]
+
+# trigram indexes backing the icontains and istartswith lookups
+POSTGRESQL_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS data_breaches_entity_name_trgm ON data_breaches_entity USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS data_breaches_source_url_trgm ON data_breaches_source USING gin (url gin_trgm_ops)",
+]
+
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX IF EXISTS data_breaches_entity_name_trgm",
+    "DROP INDEX IF EXISTS data_breaches_source_url_trgm",
+]
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_breaches', '0007_databreach_representation'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite' : SQLITE_FORWARD, 'postgresql' : POSTGRESQL_FORWARD}),
+            run({'sqlite' : SQLITE_BACKWARD, 'postgresql' : POSTGRESQL_BACKWARD}),
+        ),
+    ]
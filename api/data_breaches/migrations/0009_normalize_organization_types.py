@@ -0,0 +1,96 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+def link_organization_types(apps, schema_editor):
+    """
+    Keep one organization type row for each name, the first one, and link
+    every entity to it, in the order the rows were created so the organization
+    types of each entity keep their order.
+    """
+    OrganizationType = apps.get_model('data_breaches', 'OrganizationType')
+    EntityOrganizationType = apps.get_model('data_breaches', 'EntityOrganizationType')
+
+    kept = {}
+    duplicated = []
+    links = []
+    rows = OrganizationType.objects.order_by('id').values_list('id', 'organization_type', 'entity_id')
+    for pk, name, entity_id in rows.iterator(chunk_size=BATCH_SIZE):
+        if name in kept:
+            duplicated.append(pk)
+        else:
+            kept[name] = pk
+        links.append(EntityOrganizationType(entity_id=entity_id, organization_type_id=kept[name]))
+        if len(links) == BATCH_SIZE:
+            EntityOrganizationType.objects.bulk_create(links)
+            links = []
+    EntityOrganizationType.objects.bulk_create(links)
+
+    for i in range(0, len(duplicated), BATCH_SIZE):
+        OrganizationType.objects.filter(id__in=duplicated[i:i + BATCH_SIZE]).delete()
+
+def unlink_organization_types(apps, schema_editor):
+    """Create an organization type row for every link again."""
+    OrganizationType = apps.get_model('data_breaches', 'OrganizationType')
+    EntityOrganizationType = apps.get_model('data_breaches', 'EntityOrganizationType')
+
+    names = dict(OrganizationType.objects.values_list('id', 'organization_type'))
+    rows = []
+    for entity_id, organization_type_id in EntityOrganizationType.objects.order_by('id').values_list('entity_id', 'organization_type_id').iterator(chunk_size=BATCH_SIZE):
+        rows.append(OrganizationType(organization_type=names[organization_type_id], entity_id=entity_id))
+    EntityOrganizationType.objects.all().delete()
+    OrganizationType.objects.all().delete()
+    OrganizationType.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_breaches', '0008_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntityOrganizationType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='organization_type_links', to='data_breaches.entity')),
+                ('organization_type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entity_links', to='data_breaches.organizationtype')),
+            ],
+            options={
+                'ordering': ['id'],
+                'unique_together': {('entity', 'organization_type')},
+            },
+        ),
+        # the many to many field has no column, but sqlite would remake the
+        # entity table to add it, dropping the triggers of the search index
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='entity',
+                    name='organization_types',
+                    field=models.ManyToManyField(related_name='entities', through='data_breaches.EntityOrganizationType', to='data_breaches.organizationtype'),
+                ),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='organizationtype',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='organizationtype',
+            name='entity',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='data_breaches.entity'),
+        ),
+        migrations.RunPython(link_organization_types, unlink_organization_types),
+        migrations.RemoveField(
+            model_name='organizationtype',
+            name='entity',
+        ),
+        migrations.AlterField(
+            model_name='organizationtype',
+            name='organization_type',
+            field=models.CharField(max_length=30, unique=True),
+        ),
+    ]
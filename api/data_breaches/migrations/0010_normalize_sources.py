@@ -0,0 +1,133 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+# sqlite drops the triggers of a table when it is remade to alter its
+# columns, the triggers keeping the sources search index of 0008_search in
+# sync are created again once the table has its final columns
+SQLITE_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS data_breaches_source_fts_insert",
+    "DROP TRIGGER IF EXISTS data_breaches_source_fts_delete",
+    "DROP TRIGGER IF EXISTS data_breaches_source_fts_update",
+    """
+    CREATE TRIGGER data_breaches_source_fts_insert AFTER INSERT ON data_breaches_source BEGIN
+        INSERT INTO data_breaches_source_fts(rowid, url) VALUES (new.id, new.url);
+    END
+    """,
+    """
+    CREATE TRIGGER data_breaches_source_fts_delete AFTER DELETE ON data_breaches_source BEGIN
+        INSERT INTO data_breaches_source_fts(data_breaches_source_fts, rowid, url) VALUES ('delete', old.id, old.url);
+    END
+    """,
+    """
+    CREATE TRIGGER data_breaches_source_fts_update AFTER UPDATE ON data_breaches_source BEGIN
+        INSERT INTO data_breaches_source_fts(data_breaches_source_fts, rowid, url) VALUES ('delete', old.id, old.url);
+        INSERT INTO data_breaches_source_fts(rowid, url) VALUES (new.id, new.url);
+    END
+    """,
+    "INSERT INTO data_breaches_source_fts(data_breaches_source_fts) VALUES ('rebuild')",
+]
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in SQLITE_TRIGGERS:
+            schema_editor.execute(sql)
+
+def link_sources(apps, schema_editor):
+    """
+    Keep one source row for each url, the first one, and link every data
+    breach to it, in the order the rows were created so the sources of each
+    data breach keep their order.
+    """
+    Source = apps.get_model('data_breaches', 'Source')
+    DataBreachSource = apps.get_model('data_breaches', 'DataBreachSource')
+
+    kept = {}
+    duplicated = []
+    links = {}
+    rows = Source.objects.order_by('id').values_list('id', 'url', 'data_breach_id')
+    for pk, url, data_breach_id in rows.iterator(chunk_size=BATCH_SIZE):
+        if url in kept:
+            duplicated.append(pk)
+        else:
+            kept[url] = pk
+        # a data breach citing the same url twice is linked once
+        links.setdefault((data_breach_id, kept[url]), None)
+        if len(links) == BATCH_SIZE:
+            DataBreachSource.objects.bulk_create(
+                [DataBreachSource(data_breach_id=data_breach_id, source_id=source_id) for data_breach_id, source_id in links],
+                ignore_conflicts=True
+            )
+            links = {}
+    DataBreachSource.objects.bulk_create(
+        [DataBreachSource(data_breach_id=data_breach_id, source_id=source_id) for data_breach_id, source_id in links],
+        ignore_conflicts=True
+    )
+
+    for i in range(0, len(duplicated), BATCH_SIZE):
+        Source.objects.filter(id__in=duplicated[i:i + BATCH_SIZE]).delete()
+
+def unlink_sources(apps, schema_editor):
+    """Create a source row for every link again."""
+    Source = apps.get_model('data_breaches', 'Source')
+    DataBreachSource = apps.get_model('data_breaches', 'DataBreachSource')
+
+    urls = dict(Source.objects.values_list('id', 'url'))
+    rows = []
+    for data_breach_id, source_id in DataBreachSource.objects.order_by('id').values_list('data_breach_id', 'source_id').iterator(chunk_size=BATCH_SIZE):
+        rows.append(Source(url=urls[source_id], data_breach_id=data_breach_id))
+    DataBreachSource.objects.all().delete()
+    Source.objects.all().delete()
+    Source.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_breaches', '0009_normalize_organization_types'),
+    ]
+
+    operations = [
+        # creates the triggers again once the migration is reversed
+        migrations.RunPython(migrations.RunPython.noop, create_triggers),
+        migrations.CreateModel(
+            name='DataBreachSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_breach', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='source_links', to='data_breaches.databreach')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='databreach_links', to='data_breaches.source')),
+            ],
+            options={
+                'ordering': ['id'],
+                'unique_together': {('data_breach', 'source')},
+            },
+        ),
+        # the many to many field has no column, sqlite would remake the data
+        # breaches table to add it
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='databreach',
+                    name='sources',
+                    field=models.ManyToManyField(related_name='databreaches', through='data_breaches.DataBreachSource', to='data_breaches.source'),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='source',
+            name='data_breach',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='databreach', to='data_breaches.databreach'),
+        ),
+        migrations.RunPython(link_sources, unlink_sources),
+        migrations.RemoveField(
+            model_name='source',
+            name='data_breach',
+        ),
+        migrations.AlterField(
+            model_name='source',
+            name='url',
+            field=models.URLField(unique=True),
+        ),
+        migrations.RunPython(create_triggers, migrations.RunPython.noop),
+    ]
@@ -1,38 +1,119 @@
 from django.db import models
 from django.core.validators import MinValueValidator
+from django.utils import timezone
+
+class RepresentedQuerySet(models.QuerySet):
+    """
+    QuerySet of the models making up the representation stored on data
+    breaches. Unlike `save` and `delete`, `update` sends no signals, so it
+    clears the stored representation of the data breaches it changes and
+    invalidates the cached responses itself. `bulk_update` goes through
+    `update`. Writes made with raw sql are not covered, rebuild the
+    representations after them, see `representations.refresh_representations`.
+    """
+    # lookup from DataBreach to the model of the queryset, None for DataBreach
+    databreach_lookup = None
+
+    def update(self, **kwargs):
+        # writing the representation alone does not change the data
+        if not set(kwargs) - {'representation'}:
+            return super().update(**kwargs)
+
+        if self.databreach_lookup is None:
+            kwargs.setdefault('representation', None)
+            rows = super().update(**kwargs)
+        else:
+            # read before the update, which may change the filtered columns
+            pks = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            DataBreach.objects.filter(**{self.databreach_lookup + '__in' : pks}).update(representation=None)
+        if rows:
+            from .caching import invalidate
+            invalidate()
+        return rows
+
+class SourceQuerySet(RepresentedQuerySet):
+    databreach_lookup = 'sources'
+
+class OrganizationTypeQuerySet(RepresentedQuerySet):
+    databreach_lookup = 'entity__organization_types'
+
+class EntityQuerySet(RepresentedQuerySet):
+    databreach_lookup = 'entity'
+
+class DataBreachQuerySet(RepresentedQuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            from .caching import invalidate
+            invalidate()
+        return objs
 
 # Create your models here.
 class Source(models.Model):
     """
-    Model storing url's of midia sources covering data breaches.
+    Model storing url's of midia sources covering data breaches. Each url is
+    stored once and shared by every data breach it covers.
 
     Attributes:
         url (URLField) : url of the midia source.
-        data_breach (ForeignKey) : wich data breach the source covers.
 
     Relations:
-        * Source - DataBreach (N:1) : one data breach can have many midia sources as reference.
+        * Source - DataBreach (N:N) : one data breach can have many midia sources as reference,
+        and one midia source can cover many data breaches.
+    """
+    url = models.URLField(unique=True)
+
+    objects = SourceQuerySet.as_manager()
+
+class DataBreachSource(models.Model):
+    """
+    Model linking data breaches to their sources, the `through` model of
+    `DataBreach.sources`. Links are ordered by id, so the sources of a data
+    breach keep the order they were added in.
+
+    Attributes:
+        data_breach (ForeignKey) : foreign key relationship with DataBreach Model.
+        source (ForeignKey) : foreign key relationship with Source Model.
     """
-    url = models.URLField()
-    data_breach = models.ForeignKey('DataBreach', related_name='databreach',on_delete=models.PROTECT)
+    data_breach = models.ForeignKey('DataBreach', related_name='source_links', on_delete=models.CASCADE)
+    source = models.ForeignKey('Source', related_name='databreach_links', on_delete=models.PROTECT)
+
+    class Meta:
+        ordering = ['id']
+        unique_together = ('data_breach', 'source')
 
 class OrganizationType(models.Model):
     """
-    Model storing entity organization type. Represents the sphere of action
-    of an entity.
+    Model storing organization types. Represents a sphere of action of
+    entities, each type is stored once and shared by every entity acting in it.
 
     Attributes:
         organization_type (CharField) : string representing sphere of action.
-        entity (ForeignKey) : foreign key relationship with Entity Model.
 
     Relations:
-        * OrganizationType - Entity (N:1) : one entity can act in many fields of work.
+        * OrganizationType - Entity (N:N) : many entities can act in the same field of work.
     """
-    organization_type = models.CharField(max_length=30)
-    entity = models.ForeignKey('Entity', on_delete=models.PROTECT)
-    
+    organization_type = models.CharField(max_length=30, unique=True)
+
+    objects = OrganizationTypeQuerySet.as_manager()
+
+class EntityOrganizationType(models.Model):
+    """
+    Model linking entities to their organization types, the `through` model of
+    `Entity.organization_types`. Links are ordered by id, so the organization
+    types of an entity keep the order they were added in.
+
+    Attributes:
+        entity (ForeignKey) : foreign key relationship with Entity Model.
+        organization_type (ForeignKey) : foreign key relationship with OrganizationType Model.
+    """
+    entity = models.ForeignKey('Entity', related_name='organization_type_links', on_delete=models.CASCADE)
+    organization_type = models.ForeignKey('OrganizationType', related_name='entity_links', on_delete=models.PROTECT)
+
     class Meta:
-        unique_together = ('organization_type', 'entity')
+        ordering = ['id']
+        unique_together = ('entity', 'organization_type')
 
 class Entity(models.Model):
     """
@@ -40,12 +121,38 @@ class Entity(models.Model):
 
     Attributes:
         name (CharField) : string containing entity name.
+        organization_types (ManyToManyField) : organization types of the entity.
 
     Relations :
         * Entity - DataBreach (1:N) : one entity can be involved in many data breaches(yikes).
-        * Entity - OrganizationType (1:N) : one entity can have a broad sphere of action with many fields of work.
+        * Entity - OrganizationType (N:N) : one entity can have a broad sphere of action with many fields of work.
     """
     name = models.CharField(max_length=500, unique=True)
+    organization_types = models.ManyToManyField(
+        'OrganizationType',
+        through='EntityOrganizationType',
+        related_name='entities'
+    )
+
+    objects = EntityQuerySet.as_manager()
+
+    def get_organization_types(self):
+        """
+        Get the names of the organization types of the entity in the order they
+        were added, reusing the links prefetched with
+        `organization_types_prefetch`.
+        """
+        return [link.organization_type.organization_type for link in self.organization_type_links.all()]
+
+def organization_types_prefetch(lookup='organization_type_links'):
+    """
+    Prefetch of the organization types links of entities, with their
+    organization type, for `Entity.get_organization_types`.
+
+    Args:
+        lookup (str) : path to the links, `entity__organization_type_links` from data breaches.
+    """
+    return models.Prefetch(lookup, queryset=EntityOrganizationType.objects.select_related('organization_type'))
 
 class DataBreach(models.Model):
     """
@@ -55,13 +162,107 @@ class DataBreach(models.Model):
         year (PositiveSmallIntegerField) : integer of the year when the data breach happened.
         records (PositiveIntegerField) : integer containing the amount of compromised records.
         method (CharField): string containing the method used in the breaching process.
+        representation (JSONField) : the data breach as returned by the api, with its
+        entity, organization types and sources, so reads do not join other tables.
+        Kept up to date by the serializers and importers, see `representations`.
+        sources (ManyToManyField) : midia sources covering the data breach.
 
     Relations:
         * DataBreach - Entity (N:1) : one data breach involves one entity. but an entity can be
         involved in many data breaches.
-        * DataBreach - OrganizationType (1:N) : The entity related to the data breach can have
+        * DataBreach - OrganizationType (N:N) : The entity related to the data breach can have
+        many organization types.
+        * DataBreach - Source (N:N) : one data breach can have many midia sources as reference.
     """
     entity = models.ForeignKey('Entity', related_name='entity',on_delete=models.PROTECT)
-    year = models.PositiveSmallIntegerField(validators=[MinValueValidator(1970)])
-    records = models.PositiveIntegerField(validators=[MinValueValidator(1)])
-    method = models.CharField(max_length=30)
+    year = models.PositiveSmallIntegerField(validators=[MinValueValidator(1970)], db_index=True)
+    records = models.PositiveIntegerField(validators=[MinValueValidator(1)], db_index=True)
+    method = models.CharField(max_length=30, db_index=True)
+    representation = models.JSONField(null=True, blank=True, editable=False)
+    sources = models.ManyToManyField('Source', through='DataBreachSource', related_name='databreaches')
+
+    objects = DataBreachQuerySet.as_manager()
+
+    def get_sources(self):
+        """
+        Get the urls of the sources of the data breach in the order they were
+        added, reusing the links prefetched with `sources_prefetch`.
+        """
+        return [link.source.url for link in self.source_links.all()]
+
+def sources_prefetch(lookup='source_links'):
+    """
+    Prefetch of the sources links of data breaches, with their source, for
+    `DataBreach.get_sources`.
+
+    Args:
+        lookup (str) : path to the links.
+    """
+    return models.Prefetch(lookup, queryset=DataBreachSource.objects.select_related('source'))
+
+class DatasetVersion(models.Model):
+    """
+    Model storing the version of the data breaches data. There is a single
+    row, its version is incremented every time a data breach, entity,
+    organization type or source changes.
+
+    Attributes:
+        version (PositiveBigIntegerField) : integer incremented on every change.
+        updated_at (DateTimeField) : when the data last changed.
+    """
+    version = models.PositiveBigIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+class ImportJob(models.Model):
+    """
+    Model storing a data breaches import sent to the api, processed in the
+    background by the `run_import_jobs` command, see `jobs`.
+
+    Attributes:
+        status (CharField) : `pending` until a worker picks the job, then
+        `running` and at last `done`, or `failed` when the payload could not be read.
+        payload (TextField) : data breaches to import, as a json array or one
+        data breach per line (NDJSON). Cleared once the job is over.
+        batch_size (PositiveIntegerField) : amount of data breaches imported at a time.
+        processed (PositiveIntegerField) : amount of data breaches read so far.
+        created (PositiveIntegerField) : amount of data breaches imported so far.
+        failed (PositiveIntegerField) : amount of data breaches that could not be imported.
+        errors (JSONField) : the first errors of the data breaches that could
+        not be imported, with their `index` in the payload and the `error`.
+        error (TextField) : why the job failed.
+        created_at (DateTimeField) : when the job was sent.
+        started_at (DateTimeField) : when a worker picked the job.
+        finished_at (DateTimeField) : when the job was over.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    payload = models.TextField(blank=True)
+    batch_size = models.PositiveIntegerField(default=1000, validators=[MinValueValidator(1)])
+    processed = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def throughput(self):
+        """Data breaches read per second since the job started, None before it starts."""
+        if self.started_at is None:
+            return None
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return self.processed / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,35 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+class DataBreachCursorPagination(CursorPagination):
+    """
+    Keyset pagination for data breaches ordered by primary key.
+
+    Each page is fetched with ``WHERE id > <cursor> ORDER BY id LIMIT n`` so
+    the cost of a page is the same no matter how deep the client is paging,
+    unlike OFFSET based pagination. The page size can be chosen by the client
+    with the `page_size` query parameter. The default and the biggest page
+    size are set by the `DATA_BREACHES_PAGE_SIZE` and
+    `DATA_BREACHES_MAX_PAGE_SIZE` settings.
+
+    Example of a paginated response:
+
+    .. code-block:: json
+
+        {
+            "next" : "http://localhost:8000/api/databreaches/?cursor=cD0y",
+            "previous" : null,
+            "results" : []
+        }
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    # the settings are read at every request so that they can be overridden
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'DATA_BREACHES_MAX_PAGE_SIZE', 1000)
+
+    def get_page_size(self, request):
+        self.page_size = getattr(settings, 'DATA_BREACHES_PAGE_SIZE', 100)
+        return super().get_page_size(request)
@@ -0,0 +1,56 @@
+import hashlib
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from rest_framework_api_key.permissions import HasAPIKey
+from .caching import get_cache, get_setting, is_shared_cache, make_key
+
+def api_key_cache_key(prefix):
+    return make_key('api_key', prefix)
+
+class CachedHasAPIKey(HasAPIKey):
+    """
+    HasAPIKey permission keeping the keys it verified in the cache for a short
+    time, so the api key query and hasher run once per key instead of once per
+    request.
+
+    Only the sha256 digest of a verified key is cached, under the key prefix,
+    along with its expiry date. A request is allowed without hitting the
+    database when the digest of its key matches the cached one and the key has
+    not expired. Revoking, changing or deleting an api key removes it from the
+    cache, see `signals`. The time keys are kept is set by `API_KEY_TIMEOUT` in
+    the `DATA_BREACHES_CACHE` setting, 0 disables it.
+
+    Keys are only cached on a shared cache: with the local memory cache of
+    each process, a key revoked by one process would still be accepted by the
+    others until it times out. Changes made with `QuerySet.update` send no
+    signals, so they only reach cached keys once they time out.
+    """
+    def has_permission(self, request, view):
+        timeout = get_setting('API_KEY_TIMEOUT')
+        # revoking a key removes it from the cache, which only reaches every
+        # worker when they share the cache
+        if not timeout or not is_shared_cache():
+            return super().has_permission(request, view)
+
+        key = self.get_key(request)
+        if not key:
+            return False
+
+        prefix, _, _ = key.partition('.')
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        cache = get_cache()
+        cached = cache.get(api_key_cache_key(prefix))
+        if cached is not None:
+            cached_digest, expiry_date = cached
+            if constant_time_compare(cached_digest, digest) and (expiry_date is None or expiry_date > timezone.now()):
+                return True
+
+        try:
+            api_key = self.model.objects.get_from_key(key)
+        except self.model.DoesNotExist:
+            return False
+        if api_key.has_expired:
+            return False
+
+        cache.set(api_key_cache_key(prefix), (digest, api_key.expiry_date), timeout)
+        return True
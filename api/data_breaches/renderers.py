@@ -0,0 +1,163 @@
+import codecs
+import csv
+import io
+import json
+from rest_framework import parsers, renderers
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    JSONRenderer encoding with orjson when it is installed, falling back to the
+    stdlib json module of JSONRenderer otherwise.
+
+    The output is the same bytes JSONRenderer gives for the data breaches
+    payloads (dicts, lists, strings, integers, None, dates), with the compact
+    and unicode settings DRF uses by default. Anything orjson would encode
+    differently goes through JSONRenderer: indented output (`indent` in the
+    accept header or the browsable API), `COMPACT_JSON` or `UNICODE_JSON` off,
+    non string keys and integers bigger than 64 bits. Floats are not part of
+    these payloads, orjson writes exponents and NaN differently than json.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # same escaping JSONRenderer does, so the output is a javascript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+class FastJSONParser(parsers.JSONParser):
+    """
+    JSONParser decoding with orjson when it is installed, falling back to the
+    stdlib json module of JSONParser otherwise. Bodies orjson rejects are parsed
+    again by JSONParser, so invalid json gets the same `ParseError` and the
+    `NaN` and `Infinity` constants are handled as before.
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        if orjson is None or codecs.lookup(parsers.get_encoding(parser_context)).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read() if stream is not None else b''
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    Render data as newline delimited json, one json object per line.
+
+    `stream` turns an iterable of data breaches representations into chunks of
+    lines for a `StreamingHttpResponse`, `render` is used for error responses.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def dumps(self, data):
+        if orjson is not None:
+            try:
+                return orjson.dumps(data).decode()
+            except TypeError:
+                pass
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return (self.dumps(data) + '\n').encode(self.charset)
+
+    def stream(self, rows, chunk_size=500):
+        """
+        Yield chunks with `chunk_size` json lines.
+
+        Args:
+            rows (iterable) : data breaches representations.
+            chunk_size (int) : amount of lines per chunk.
+        """
+        lines = []
+        for row in rows:
+            lines.append(self.dumps(row))
+            if len(lines) == chunk_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+class Echo:
+    """Pseudo buffer returning what is written to it, used to get csv lines as strings."""
+    def write(self, value):
+        return value
+
+class CSVRenderer(renderers.BaseRenderer):
+    """
+    Render data breaches as csv with the header below. Organization types are
+    separated by `|` and sources by a space.
+
+    ```code
+    id,entity,organization_type,year,records,method,sources
+    ```
+
+    `stream` turns an iterable of data breaches representations into chunks of
+    lines for a `StreamingHttpResponse`, `render` is used for error responses.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+    header = ['id', 'entity', 'organization_type', 'year', 'records', 'method', 'sources']
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        writer = csv.writer(Echo())
+        if isinstance(data, dict):
+            lines = [writer.writerow([key, value]) for key, value in data.items()]
+        else:
+            lines = [writer.writerow([data])]
+        return ''.join(lines).encode(self.charset)
+
+    def row(self, databreach):
+        """Get the csv columns of a data breach representation."""
+        return [
+            databreach['id'],
+            databreach['entity']['name'],
+            '|'.join(databreach['entity']['organization_type']),
+            databreach['year'],
+            databreach['records'],
+            databreach['method'],
+            ' '.join(databreach['sources'])
+        ]
+
+    def stream(self, rows, chunk_size=500):
+        """
+        Yield the csv header and then chunks with `chunk_size` csv lines.
+
+        Args:
+            rows (iterable) : data breaches representations.
+            chunk_size (int) : amount of lines per chunk.
+        """
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.header)
+        lines = []
+        for row in rows:
+            lines.append(writer.writerow(self.row(row)))
+            if len(lines) == chunk_size:
+                yield ''.join(lines)
+                lines = []
+        if lines:
+            yield ''.join(lines)
@@ -0,0 +1,197 @@
+from .models import DataBreach, organization_types_prefetch, sources_prefetch
+
+def make_representation(name, organization_type, year, records, method, sources):
+    """
+    Build the stored representation of a data breach, which is its api
+    representation without the `id`, known only once the data breach is saved.
+
+    Args:
+        name (str) : entity name.
+        organization_type (list) : organization types of the entity.
+        year (int) : year of the data breach.
+        records (int) : amount of compromised records.
+        method (str) : method used in the breaching process.
+        sources (list) : urls of the midia sources.
+    """
+    return {
+        'entity' : {
+            'name' : name,
+            'organization_type' : list(organization_type)
+        },
+        'year' : year,
+        'records' : records,
+        'method' : method,
+        'sources' : list(sources)
+    }
+
+def build_representation(databreach):
+    """
+    Build the stored representation of a data breach from its entity,
+    organization types and sources, reading through the relations so
+    prefetched objects are reused.
+    """
+    entity = databreach.entity
+    return make_representation(
+        entity.name,
+        entity.get_organization_types(),
+        databreach.year,
+        databreach.records,
+        databreach.method,
+        databreach.get_sources()
+    )
+
+def get_representation(databreach):
+    """
+    Get the api representation of a data breach, from its `representation`
+    column when it is filled or built from its relations otherwise.
+
+    Returns:
+        Dictionary with the DataBreach data representation, see
+        `DataBreachSerializer.to_representation`.
+    """
+    data = databreach.representation
+    if data is None:
+        data = build_representation(databreach)
+
+    # keys are put in order here as jsonb columns do not keep it
+    entity = data['entity']
+    return {
+        'id' : databreach.id,
+        'entity' : {
+            'name' : entity['name'],
+            'organization_type' : entity['organization_type']
+        },
+        'year' : data['year'],
+        'records' : data['records'],
+        'method' : data['method'],
+        'sources' : data['sources']
+    }
+
+# fields of sparse representations, chosen with `?fields=`, and relations
+# included in them only when expanded with `?expand=`
+SPARSE_FIELDS = ['id', 'entity.name', 'year', 'records', 'method']
+EXPANSIONS = ['organization_type', 'sources']
+
+def parse_fieldset(fields=None, expand=None):
+    """
+    Parse the comma separated `fields` and `expand` query parameters of a
+    sparse representation. `entity` is the same as `entity.name`, and
+    relations listed in `fields` are expanded. When only `expand` is given
+    every field is included.
+
+    Returns:
+        Tuple with the set of fields and the set of expanded relations, or
+        None when neither parameter is given and the full representation is
+        wanted.
+
+    Raises:
+        ValueError : when a field or relation is unknown.
+    """
+    if not fields and not expand:
+        return None
+
+    aliases = {'entity' : 'entity.name', 'entity.organization_type' : 'organization_type'}
+    chosen = set()
+    expanded = set()
+    for name in filter(None, (name.strip() for name in (fields or '').split(','))):
+        name = aliases.get(name, name)
+        if name in EXPANSIONS:
+            expanded.add(name)
+        elif name in SPARSE_FIELDS:
+            chosen.add(name)
+        else:
+            raise ValueError('Unknown field %s, choose from %s.' % (name, ', '.join(SPARSE_FIELDS + EXPANSIONS)))
+    for name in filter(None, (name.strip() for name in (expand or '').split(','))):
+        if name not in EXPANSIONS:
+            raise ValueError('Unknown relation %s, choose from %s.' % (name, ', '.join(EXPANSIONS)))
+        expanded.add(name)
+
+    if not fields:
+        chosen.update(SPARSE_FIELDS)
+    return chosen, expanded
+
+def sparse_queryset(queryset, fieldset):
+    """
+    Restrict `queryset` to the columns needed by the sparse representations
+    of `fieldset`. Without expanded relations the stored representation is
+    not read, only the data breach columns and the entity name if chosen.
+    With them the stored representation is read, as it holds the relations.
+    """
+    fields, expanded = fieldset
+    if expanded:
+        return queryset
+    if 'entity.name' in fields:
+        return queryset.select_related('entity').only('id', 'year', 'records', 'method', 'entity__name')
+    return queryset.only('id', 'year', 'records', 'method')
+
+def get_sparse_representation(databreach, fieldset):
+    """
+    Get the api representation of a data breach with only the fields and
+    expanded relations of `fieldset`, read from a data breach of
+    `sparse_queryset`. Keys keep the order of the full representation.
+    """
+    fields, expanded = fieldset
+    if expanded:
+        full = get_representation(databreach)
+        entity = full['entity']
+    else:
+        full = {
+            'id' : databreach.id,
+            'year' : databreach.year,
+            'records' : databreach.records,
+            'method' : databreach.method,
+        }
+        entity = {'name' : databreach.entity.name} if 'entity.name' in fields else {}
+
+    data = {}
+    if 'id' in fields:
+        data['id'] = full['id']
+    if 'entity.name' in fields or 'organization_type' in expanded:
+        data['entity'] = {}
+        if 'entity.name' in fields:
+            data['entity']['name'] = entity['name']
+        if 'organization_type' in expanded:
+            data['entity']['organization_type'] = entity['organization_type']
+    for name in ['year', 'records', 'method']:
+        if name in fields:
+            data[name] = full[name]
+    if 'sources' in expanded:
+        data['sources'] = full['sources']
+    return data
+
+def save_representation(databreach):
+    """Build the representation of a data breach and store it."""
+    databreach.representation = build_representation(databreach)
+    DataBreach.objects.filter(pk=databreach.pk).update(representation=databreach.representation)
+
+def refresh_representations(queryset, batch_size=1000):
+    """
+    Build and store the representation of the data breaches of `queryset`, in
+    batches of `batch_size` data breaches read with their entity, organization
+    types and sources prefetched and written with `bulk_update`.
+
+    Must be called after every write changing a data breach, its entity, the
+    organization types of its entity or its sources that does not go through
+    `DataBreachSerializer`, `EntitySerializer` or the importers.
+
+    Returns:
+        Amount of data breaches refreshed.
+    """
+    queryset = queryset.select_related('entity').prefetch_related(
+        organization_types_prefetch('entity__organization_type_links'),
+        sources_prefetch()
+    ).order_by('id')
+
+    refreshed = 0
+    batch = []
+    for databreach in queryset.iterator(chunk_size=batch_size):
+        databreach.representation = build_representation(databreach)
+        batch.append(databreach)
+        if len(batch) == batch_size:
+            DataBreach.objects.bulk_update(batch, ['representation'])
+            refreshed += len(batch)
+            batch = []
+    if batch:
+        DataBreach.objects.bulk_update(batch, ['representation'])
+        refreshed += len(batch)
+    return refreshed
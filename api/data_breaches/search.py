@@ -0,0 +1,112 @@
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .models import *
+
+# sqlite FTS5 tables indexing entity names and source urls, created by the
+# 0008_search migration and kept in sync with triggers
+ENTITY_FTS_TABLE = 'data_breaches_entity_fts'
+SOURCE_FTS_TABLE = 'data_breaches_source_fts'
+
+def use_fts():
+    return connection.vendor == 'sqlite'
+
+def get_terms(query):
+    """
+    Split a search query into terms the way the FTS5 `unicode61` tokenizer
+    splits the indexed text: letters and digits, anything else separates terms.
+    """
+    return re.findall(r'[^\W_]+', query or '')
+
+def match_expression(terms, initial=False):
+    """
+    Build a FTS5 query matching the rows with a word starting with each term.
+    Terms only have letters and digits, so quoting them is enough to keep
+    FTS5 operators out of the query.
+
+    Args:
+        terms (list) : terms returned by `get_terms`.
+        initial (bool) : the first term must start the text.
+    """
+    expression = ' AND '.join('"%s"*' % term for term in terms)
+    return '^' + expression if initial else expression
+
+def search_databreaches(queryset, query):
+    """
+    Filter data breaches whose entity name or one of the source urls has a
+    word starting with each term of `query`. On sqlite the FTS5 indexes are
+    used, on postgres the trigram indexes back the `icontains` lookups used on
+    any other database.
+
+    Args:
+        queryset (QuerySet) : data breaches queryset.
+        query (str) : search query, a query without terms does not filter.
+    """
+    terms = get_terms(query)
+    if not terms:
+        return queryset
+
+    if use_fts():
+        expression = match_expression(terms)
+        entities = RawSQL(
+            'SELECT rowid FROM %s WHERE %s MATCH %%s' % (ENTITY_FTS_TABLE, ENTITY_FTS_TABLE),
+            [expression]
+        )
+        sources = RawSQL(
+            'SELECT data_breach_id FROM %s WHERE source_id IN '
+            '(SELECT rowid FROM %s WHERE %s MATCH %%s)' % (
+                DataBreachSource._meta.db_table, SOURCE_FTS_TABLE, SOURCE_FTS_TABLE
+            ),
+            [expression]
+        )
+        return queryset.filter(Q(entity_id__in=entities) | Q(id__in=sources))
+
+    entity_lookup = Q()
+    source_lookup = Q()
+    for term in terms:
+        entity_lookup &= Q(name__icontains=term)
+        source_lookup &= Q(url__icontains=term)
+    return queryset.filter(
+        Q(entity_id__in=Entity.objects.filter(entity_lookup).values('id')) |
+        Q(id__in=DataBreachSource.objects.filter(source__in=Source.objects.filter(source_lookup)).values('data_breach_id'))
+    )
+
+def autocomplete_entities(query, limit=10):
+    """
+    Get the names of the entities matching a search query, for autocompletion.
+    Entities whose name starts with the query come first, followed by the ones
+    with a word starting with each term. Every lookup is limited, so its cost
+    does not depend on the amount of entities.
+
+    Args:
+        query (str) : text typed by the user.
+        limit (int) : most names returned.
+
+    Returns:
+        List of entity names.
+    """
+    terms = get_terms(query)
+    if not terms or limit < 1:
+        return []
+
+    if use_fts():
+        names = []
+        with connection.cursor() as cursor:
+            for initial in [True, False]:
+                cursor.execute(
+                    'SELECT name FROM %s WHERE %s MATCH %%s LIMIT %%s' % (ENTITY_FTS_TABLE, ENTITY_FTS_TABLE),
+                    [match_expression(terms, initial=initial), limit + len(names)]
+                )
+                names += [name for name, in cursor.fetchall() if name not in names]
+                if len(names) >= limit:
+                    break
+        return names[:limit]
+
+    names = list(Entity.objects.filter(name__istartswith=query.strip()).values_list('name', flat=True)[:limit])
+    if len(names) < limit:
+        lookup = Q()
+        for term in terms:
+            lookup &= Q(name__icontains=term)
+        names += Entity.objects.filter(lookup).exclude(name__in=names).values_list('name', flat=True)[:limit - len(names)]
+    return names
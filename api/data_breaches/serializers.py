@@ -1,6 +1,13 @@
 from rest_framework import serializers
-from django.db import transaction
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
+from .bulk import delete_orphan_organization_types, raw_delete
+from .caching import defer_invalidation, invalidate
+from .filters import DataBreachFilter
+from .importers import BulkImporter
 from .models import *
+from .representations import get_representation, get_sparse_representation, refresh_representations, save_representation
 
 class SourceSerializer(serializers.ModelSerializer):
     class Meta:
@@ -31,14 +38,37 @@ class EntitySerializer(serializers.ModelSerializer):
             }
         """
 
-        org_type = OrganizationType.objects.filter(entity=obj)
-
         return {
             'id': obj.id,
             'name': obj.name,
-            'organization_type': [t.organization_type for t in org_type]
+            'organization_type': obj.get_organization_types()
         }
 
+    def clean_organization_types(self):
+        """
+        Get the names of the organization types passed in context, stripped
+        like the other fields and without repetitions, checking they fit the
+        OrganizationType model. OrganizationType objects are accepted too.
+        """
+        org_data = self.context.get('extra', {}).get('organization_type', [])
+        org_types = [getattr(org, 'organization_type', org) for org in org_data]
+        org_types = [org.strip() if isinstance(org, str) else org for org in org_types]
+        max_length = OrganizationType._meta.get_field('organization_type').max_length
+        for org_type in org_types:
+            if not isinstance(org_type, str) or not org_type or len(org_type) > max_length:
+                raise serializers.ValidationError({
+                    'organization_type' : 'Organization types must be strings of 1 to %d characters.' % max_length
+                })
+        return list(dict.fromkeys(org_types))
+
+    def link_organization_types(self, entity, org_types):
+        """Link the entity to the organization types named, creating the missing ones."""
+        type_ids = BulkImporter().resolve_organization_types(set(org_types))
+        EntityOrganizationType.objects.bulk_create([
+            EntityOrganizationType(entity=entity, organization_type_id=type_ids[org_type])
+            for org_type in org_types
+        ])
+
     def create(self, validated_data):
         """Override to create Entity and OrganizationType objects with extra content
         passed in context.
@@ -46,56 +76,273 @@ class EntitySerializer(serializers.ModelSerializer):
             * organization_type (list) : list of strings containing the organization sphere
         of action.
         """
+        org_types = self.clean_organization_types()
         with transaction.atomic():
             entity, created = Entity.objects.get_or_create(name=validated_data['name'])
-            if created and 'extra' in self.context:
-                org_data = self.context['extra'].get('organization_type', [])
-                orgs = []
-                for org in org_data:
-                    orgs.append({
-                        'entity' : entity.id,
-                        'organization_type' : org
-                    })
-
-                org_serializer = OrganizationTypeSerializer(data=orgs, many=True)
-                org_serializer.is_valid(raise_exception=True)
-                org_serializer.save()
+            if created and org_types:
+                self.link_organization_types(entity, org_types)
+                # bulk creates do not send signals
+                invalidate()
 
         return entity
 
     def update(self, instance, validated_data):
         """Override to update Entity and OrganizationType objects with extra content
-        passed in context.
+        passed in context. Only the organization types added or removed are
+        linked or unlinked, with at most one DELETE and one INSERT query of
+        links, and nothing is written when neither the name nor the
+        organization types changed.
         Extra data:
             * organization_type (list) : list of strings containing the organization sphere
-        of action.
+        of action. An empty list keeps the current organization types.
         """
+        org_types = self.clean_organization_types()
+
         with transaction.atomic():
-            org_data = self.context['extra'].get('organization_type', [])
-            # substitute the organization_type 
-            if len(org_data) != 0:
-                orgs_qs = OrganizationType.objects.filter(entity=instance)
-                for org in orgs_qs:
-                    org.delete()
-
-                orgs = []
-                for org in org_data:
-                    orgs.append({
-                        'entity' : instance.id,
-                        'organization_type' : org.organization_type
-                    })
-                orgs_serializer = OrganizationTypeSerializer(data=orgs, many=True)
-                orgs_serializer.is_valid(raise_exception=True)
-                orgs_serializer.save()
-
-            instance.name = validated_data.get('name', instance.name)
-            instance.save()
+            changed = False
+            if org_types:
+                current = dict(
+                    instance.organization_type_links.values_list('organization_type__organization_type', 'organization_type_id')
+                )
+                removed = [type_id for org_type, type_id in current.items() if org_type not in org_types]
+                added = [org_type for org_type in org_types if org_type not in current]
+                if removed:
+                    raw_delete(EntityOrganizationType.objects.filter(entity=instance, organization_type_id__in=removed))
+                    # organization types no other entity acts in
+                    delete_orphan_organization_types(removed)
+                if added:
+                    self.link_organization_types(instance, added)
+                changed = bool(removed or added)
+
+            name = validated_data.get('name', instance.name)
+            if name != instance.name:
+                instance.name = name
+                instance.save(update_fields=['name'])
+                changed = True
+
+            if changed:
+                # raw deletes and bulk creates do not send signals
+                invalidate()
+                refresh_representations(DataBreach.objects.filter(entity=instance))
         return instance
 
+class DataBreachExtraSerializer(serializers.Serializer):
+    """Validate the organization types and sources sent with a data breach,
+    which are not fields of the DataBreach model.
+    """
+    organization_type = serializers.ListField(
+        child=serializers.CharField(max_length=OrganizationType._meta.get_field('organization_type').max_length),
+        required=False,
+        default=list
+    )
+    sources = serializers.ListField(
+        child=serializers.URLField(max_length=Source._meta.get_field('url').max_length),
+        required=False,
+        default=list
+    )
+
+    def validate_sources(self, value):
+        # a data breach cites each url once
+        return list(dict.fromkeys(value))
+
+# biggest amount of data breaches changed by a bulk action
+MAX_BULK_SIZE = 10000
+
+class DataBreachSelectionSerializer(serializers.Serializer):
+    """
+    Validate a selection of data breaches for bulk actions: either a list of
+    `ids` or a `filter` with the filters of the data breaches list.
+
+    Example:
+
+    .. code-block:: json
+
+        {"ids" : [1, 2, 3]}
+        {"filter" : {"entity" : "Test", "year" : 2021}}
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        allow_empty=False,
+        max_length=MAX_BULK_SIZE
+    )
+    filter = serializers.DictField(required=False, allow_empty=False)
+
+    def validate_filter(self, value):
+        unknown = set(value) - set(DataBreachFilter.base_filters)
+        if unknown:
+            raise serializers.ValidationError('Unknown filters: %s.' % ', '.join(sorted(unknown)))
+        # a filter without values would select every data breach
+        if all(v in (None, '') for v in value.values()):
+            raise serializers.ValidationError('At least one filter needs a value.')
+
+        filterset = DataBreachFilter(data=value, queryset=DataBreach.objects.all())
+        if not filterset.is_valid():
+            raise serializers.ValidationError(filterset.errors)
+        return value
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError('Send either a list of ids or a filter.')
+        return attrs
+
+    def get_queryset(self):
+        """Get the selected data breaches."""
+        if 'ids' in self.validated_data:
+            return DataBreach.objects.filter(id__in=self.validated_data['ids'])
+        return DataBreachFilter(data=self.validated_data['filter'], queryset=DataBreach.objects.all()).qs
+
+class DataBreachIdsSerializer(serializers.Serializer):
+    """
+    Validate the ids of a batch lookup, at most `DATA_BREACHES_MAX_BATCH_SIZE`.
+    Repeated ids are looked up once. Example:
+
+    .. code-block:: json
+
+        {"ids" : [1, 2, 3]}
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False
+    )
+
+    def validate_ids(self, value):
+        # read when validating so that the setting can be overridden
+        max_length = getattr(settings, 'DATA_BREACHES_MAX_BATCH_SIZE', 1000)
+        if len(value) > max_length:
+            self.fields['ids'].fail('max_length', max_length=max_length)
+        return list(dict.fromkeys(value))
+
+class DataBreachValuesSerializer(serializers.ModelSerializer):
+    """Validate new values for some of the fields of a data breach, for bulk updates."""
+    class Meta:
+        model = DataBreach
+        fields = ['year', 'records', 'method']
+        extra_kwargs = {field: {'required' : False} for field in fields}
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError('Send at least one of year, records or method.')
+        return attrs
+
+class DataBreachChangeListSerializer(serializers.ListSerializer):
+    """Serializer used by DataBreachChangeSerializer for lists, each id can only be changed once."""
+    def validate(self, attrs):
+        seen = set()
+        duplicated = set()
+        for item in attrs:
+            (duplicated if item['id'] in seen else seen).add(item['id'])
+        if duplicated:
+            raise serializers.ValidationError('Duplicated ids: %s.' % ', '.join(map(str, sorted(duplicated))))
+        return attrs
+
+class DataBreachChangeSerializer(DataBreachValuesSerializer):
+    """
+    Validate a partial update of a data breach, for bulk updates. Example:
+
+    .. code-block:: json
+
+        {"id" : 1, "method" : "hacked"}
+    """
+    id = serializers.IntegerField(min_value=1)
+
+    class Meta(DataBreachValuesSerializer.Meta):
+        fields = ['id'] + DataBreachValuesSerializer.Meta.fields
+        list_serializer_class = DataBreachChangeListSerializer
+
+    def validate(self, attrs):
+        if len(attrs) == 1:
+            raise serializers.ValidationError('Send at least one of year, records or method.')
+        return attrs
+
+class DataBreachBulkUpdateSerializer(DataBreachSelectionSerializer):
+    """
+    Validate a bulk update setting the same `values` on a selection of data
+    breaches. Example:
+
+    .. code-block:: json
+
+        {"filter" : {"entity" : "Test"}, "values" : {"method" : "hacked"}}
+    """
+    values = DataBreachValuesSerializer()
+
+class DataBreachListSerializer(serializers.ListSerializer):
+    """
+    Serializer used by DataBreachSerializer when a list of data breaches is
+    created at once.
+
+    The whole list is validated before anything is written and then created
+    in a single transaction with `BulkImporter`: entities are resolved with
+    set based queries and organization types, data breaches and sources are
+    written with `bulk_create`. The amount of queries does not depend on the
+    amount of data breaches sent, only on the database batch size.
+    """
+    def to_internal_value(self, data):
+        """Override to validate the organization types and sources of every
+        data breach along with the data breach fields.
+        """
+        validated_data = super().to_internal_value(data)
+
+        errors = []
+        for item, attrs in zip(data, validated_data):
+            entity_data = item.get('entity', {})
+            extra_serializer = DataBreachExtraSerializer(data={
+                'organization_type' : entity_data.get('organization_type', []) if isinstance(entity_data, dict) else [],
+                'sources' : item.get('sources', [])
+            })
+            if extra_serializer.is_valid():
+                attrs.update(extra_serializer.validated_data)
+                errors.append({})
+            else:
+                errors.append(extra_serializer.errors)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated_data
+
+    def create(self, validated_data):
+        """Override to create all data breaches with bulk inserts."""
+        batch = [
+            {
+                'entity' : {
+                    'name' : attrs['entity']['name'],
+                    'organization_type' : attrs['organization_type']
+                },
+                'year' : attrs['year'],
+                'records' : attrs['records'],
+                'method' : attrs['method'],
+                'sources' : attrs['sources']
+            }
+            for attrs in validated_data
+        ]
+        with defer_invalidation():
+            with transaction.atomic():
+                databreaches = BulkImporter().create(batch)
+            # bulk inserts do not send signals
+            invalidate()
+        return databreaches
+
+    def to_representation(self, data):
+        """Override to prefetch the relations of the data breaches whose
+        representation is not stored, so they are built without a query each.
+        """
+        databreaches = data.all() if isinstance(data, models.manager.BaseManager) else data
+        fieldset = self.child.context.get('fieldset')
+        if fieldset is not None and not fieldset[1]:
+            # sparse representations without relations do not read the stored one
+            return super().to_representation(databreaches)
+        missing = [databreach for databreach in databreaches if databreach.representation is None]
+        if missing:
+            prefetch_related_objects(
+                missing, 'entity', organization_types_prefetch('entity__organization_type_links'), sources_prefetch()
+            )
+        return super().to_representation(databreaches)
+
 class DataBreachSerializer(serializers.ModelSerializer):
     class Meta:
         model = DataBreach
         fields = '__all__'
+        list_serializer_class = DataBreachListSerializer
 
     entity = EntitySerializer()
 
@@ -107,6 +354,9 @@ class DataBreachSerializer(serializers.ModelSerializer):
         Args:
             obj (DataBreach) : The DataBreach object.
 
+        With a `fieldset` in the context, see `parse_fieldset`, only the chosen
+        fields and expanded relations are returned.
+
         Returns:
             Dictionary with correct DataBreach data representantion.
         Example of correct representation:
@@ -125,21 +375,12 @@ class DataBreachSerializer(serializers.ModelSerializer):
                 "sources" : ["https://pt.wikipedia.org/wiki/Wikip%C3%A9dia:P%C3%A1gina_principal"]
             }
         """
-        entity = Entity.objects.get(pk=obj.entity.id)
-        org_type = OrganizationType.objects.filter(entity=entity)
-        sources = Source.objects.filter(data_breach=obj)
-        
-        return {
-            'id' : obj.id,
-            'entity' : {
-                'name' : entity.name,
-                'organization_type' : [org.organization_type for org in org_type]
-            },
-            'year' : obj.year,
-            'records' : obj.records,
-            'method' : obj.method,
-            'sources' : [s.url for s in sources]
-        }
+        # read from the representation stored on the data breach, so no other
+        # table is queried, see `representations`.
+        fieldset = self.context.get('fieldset')
+        if fieldset is not None:
+            return get_sparse_representation(obj, fieldset)
+        return get_representation(obj)
 
     def create(self, validated_data):
         """
@@ -191,18 +432,16 @@ class DataBreachSerializer(serializers.ModelSerializer):
             # create databreach object
             databreach = DataBreach.objects.create(**validated_data, entity=entity)
 
-            # create sources
-            source_data = self.context['extra'].get('sources', [])
-            sources = []
-            for source in source_data:
-                sources.append({
-                    'url' : source,
-                    'data_breach' : databreach.id
-                })
-            source_serializer = SourceSerializer(data=sources, many=True)
-            if not source_serializer.is_valid():
-                raise serializers.ValidationError(source_serializer.errors)
-            source_serializer.save()
+            # link sources, creating the new urls
+            source_serializer = DataBreachExtraSerializer(data={'sources' : self.context['extra'].get('sources', [])})
+            source_serializer.is_valid(raise_exception=True)
+            urls = source_serializer.validated_data['sources']
+            if urls:
+                source_ids = BulkImporter().resolve_sources(set(urls))
+                DataBreachSource.objects.bulk_create([
+                    DataBreachSource(data_breach=databreach, source_id=source_ids[url]) for url in urls
+                ])
+            save_representation(databreach)
         return databreach
 
     def update(self, instance, validated_data):
@@ -228,6 +467,25 @@ class DataBreachSerializer(serializers.ModelSerializer):
                 })
                 entity_serializer.is_valid(raise_exception=True)
                 instance.entity = entity_serializer.save()
-                instance.save()
+            # saved even when the entity is not sent, so the stored
+            # representation matches the row
+            instance.save()
+            save_representation(instance)
 
         return instance
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    """
+    Status of an import job, see `jobs`: its progress, the amount of data
+    breaches read per second (`throughput`) and the errors of the data
+    breaches that could not be imported.
+    """
+    throughput = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = [
+            'id', 'status', 'processed', 'created', 'failed', 'throughput',
+            'errors', 'error', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
@@ -0,0 +1,81 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from rest_framework_api_key.models import APIKey
+from .caching import get_cache, invalidate
+from .models import *
+from .permissions import api_key_cache_key
+
+def invalidate_cache(sender, **kwargs):
+    """Invalidate cached responses when data breaches data changes."""
+    invalidate()
+
+for model in [DataBreach, Entity, OrganizationType, EntityOrganizationType, Source, DataBreachSource]:
+    post_save.connect(invalidate_cache, sender=model, dispatch_uid='invalidate_cache_save_' + model.__name__)
+    post_delete.connect(invalidate_cache, sender=model, dispatch_uid='invalidate_cache_delete_' + model.__name__)
+
+def forget_representation(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    Clear the stored representation of the data breaches changed through the
+    orm, so they are built from their relations until it is stored again.
+    Serializers and importers store it again in the same transaction.
+    """
+    if sender is DataBreach:
+        if not created and instance.representation is not None and 'representation' not in (update_fields or ()):
+            DataBreach.objects.filter(pk=instance.pk).update(representation=None)
+            instance.representation = None
+    elif sender is Source:
+        # sources are shared, changing one changes every data breach citing it
+        DataBreach.objects.filter(sources=instance).update(representation=None)
+    elif sender is DataBreachSource:
+        DataBreach.objects.filter(pk=instance.data_breach_id).update(representation=None)
+    elif sender is OrganizationType:
+        # organization types are shared, renaming one changes every entity linked to it
+        DataBreach.objects.filter(entity__organization_types=instance).update(representation=None)
+    elif sender is EntityOrganizationType:
+        DataBreach.objects.filter(entity_id=instance.entity_id).update(representation=None)
+    elif sender is Entity and not created:
+        DataBreach.objects.filter(entity_id=instance.pk).update(representation=None)
+
+for model in [DataBreach, Entity, OrganizationType, EntityOrganizationType, Source, DataBreachSource]:
+    post_save.connect(forget_representation, sender=model, dispatch_uid='forget_representation_save_' + model.__name__)
+for model in [EntityOrganizationType, DataBreachSource]:
+    post_delete.connect(forget_representation, sender=model, dispatch_uid='forget_representation_delete_' + model.__name__)
+
+# for the links of many to many fields: lookup of the data breaches by the
+# ids of the objects holding the field and the related name of the field
+LINKED_DATABREACHES = {
+    EntityOrganizationType : ('entity_id__in', 'entities'),
+    DataBreachSource : ('id__in', 'databreaches'),
+}
+
+def forget_links(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate the cache and clear the stored representations when
+    organization types or sources are linked or unlinked with the managers of
+    `Entity.organization_types` and `DataBreach.sources`, which do not send
+    `post_save` and `post_delete` signals.
+    """
+    lookup, related_name = LINKED_DATABREACHES[sender]
+    if action in ('post_add', 'post_remove'):
+        ids = pk_set if reverse else [instance.pk]
+    elif action == 'pre_clear' and reverse:
+        # the linked objects are only known before their links are removed
+        ids = list(getattr(instance, related_name).values_list('id', flat=True))
+    elif action == 'post_clear' and not reverse:
+        ids = [instance.pk]
+    elif action == 'post_clear':
+        invalidate()
+        return
+    else:
+        return
+    invalidate()
+    DataBreach.objects.filter(**{lookup : ids}).update(representation=None)
+
+for model in LINKED_DATABREACHES:
+    m2m_changed.connect(forget_links, sender=model, dispatch_uid='forget_links_' + model.__name__)
+
+def forget_api_key(sender, instance, **kwargs):
+    """Remove a revoked, changed or deleted api key from the verified keys cache."""
+    get_cache().delete(api_key_cache_key(instance.prefix))
+
+post_save.connect(forget_api_key, sender=APIKey, dispatch_uid='forget_api_key_save')
+post_delete.connect(forget_api_key, sender=APIKey, dispatch_uid='forget_api_key_delete')
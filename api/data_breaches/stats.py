@@ -0,0 +1,78 @@
+from django.db.models import Count, Max, Sum
+from .models import *
+
+AGGREGATES = {
+    'count' : Count('id'),
+    'total_records' : Sum('records'),
+    'max_records' : Max('records'),
+}
+
+def group_by(queryset, field, lookup, order_by, limit=None):
+    """
+    Aggregate data breaches grouped by a field with a single `GROUP BY` query.
+
+    Args:
+        queryset (QuerySet) : data breaches to aggregate.
+        field (str) : name of the group in the result.
+        lookup (str) : field lookup grouped by.
+        order_by (list) : ordering of the groups, using `lookup` or the aggregate names.
+        limit (int) : maximum amount of groups.
+
+    Returns:
+        List of dictionaries with the group value, `count`, `total_records` and
+        `max_records`.
+    """
+    groups = (
+        queryset.order_by()
+        .filter(**{lookup + '__isnull' : False})
+        .values(lookup)
+        .annotate(**AGGREGATES)
+        .order_by(*order_by)
+    )
+    if limit is not None:
+        groups = groups[:limit]
+
+    result = []
+    for group in groups:
+        group[field] = group.pop(lookup)
+        result.append({key : group[key] for key in [field] + list(AGGREGATES)})
+    return result
+
+def databreach_stats(queryset, top=10):
+    """
+    Compute data breaches statistics in the database.
+
+    Args:
+        queryset (QuerySet) : data breaches to aggregate.
+        top (int) : amount of entities in `top_entities`.
+
+    Returns:
+        Dictionary with the totals of all data breaches, the aggregates by year,
+        method and organization type and the `top` entities by records.
+
+    Example:
+
+    .. code-block:: json
+
+        {
+            "total" : {"count" : 2, "total_records" : 3000, "max_records" : 2000},
+            "by_year" : [{"year" : 2021, "count" : 2, "total_records" : 3000, "max_records" : 2000}],
+            "by_method" : [{"method" : "hacked", "count" : 2, "total_records" : 3000, "max_records" : 2000}],
+            "by_organization_type" : [{"organization_type" : "web", "count" : 2, "total_records" : 3000, "max_records" : 2000}],
+            "top_entities" : [{"entity" : "Test", "count" : 2, "total_records" : 3000, "max_records" : 2000}]
+        }
+    """
+    total = queryset.order_by().aggregate(**AGGREGATES)
+    total['total_records'] = total['total_records'] or 0
+    return {
+        'total' : total,
+        'by_year' : group_by(queryset, 'year', 'year', ['year']),
+        'by_method' : group_by(queryset, 'method', 'method', ['-count', 'method']),
+        'by_organization_type' : group_by(
+            queryset,
+            'organization_type',
+            'entity__organization_types__organization_type',
+            ['-count', 'entity__organization_types__organization_type']
+        ),
+        'top_entities' : group_by(queryset, 'entity', 'entity__name', ['-total_records', 'entity__name'], limit=top),
+    }
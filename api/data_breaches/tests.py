@@ -1,8 +1,32 @@
+import csv
+import inspect
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 from rest_framework_api_key.models import APIKey
+from api.metrics import registry
+from .caching import get_stats
+from .importers import BulkImporter, iter_json_array
+from .management.commands.benchmark import find_measures
+from . import benchmarks, renderers
 from .models import *
+from .representations import build_representation, make_representation, refresh_representations
+from .serializers import EntitySerializer
 
 # Create your tests here.
 class DataBreachTestCase(APITestCase):
@@ -12,6 +36,7 @@ class DataBreachTestCase(APITestCase):
         self.list_url = reverse('databreaches-list')
         self.api_key_obj, self.api_key = APIKey.objects.create_key(name='Testing APIKey')
         self.client.credentials(HTTP_AUTHORIZATION='Api-Key ' + str(self.api_key))
+        cache.clear()
 
     def compareDataBreaches(self, dt0, dt1):
         """Compare two databreaches json data.
@@ -76,9 +101,10 @@ class DataBreachTestCase(APITestCase):
             self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
 
         response = self.client.get(list_url)
-        self.assertEqual(len(response.data), 2)
+        results = response.data['results']
+        self.assertEqual(len(results), 2)
         for i in range(len(data)):
-            self.assertTrue(self.compareDataBreaches(data[i], response.data[i]), "Data is different !\nOriginal Data : " + str(data[i]) + '\nReponse from API: ' + str(response.data[i]))
+            self.assertTrue(self.compareDataBreaches(data[i], results[i]), "Data is different !\nOriginal Data : " + str(data[i]) + '\nReponse from API: ' + str(results[i]))
 
 
     def test_create(self):
@@ -131,6 +157,84 @@ class DataBreachTestCase(APITestCase):
         response = self.client.post(create_url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+        # sources longer than the url column
+        data = {
+            'entity' : {
+                'name' : 'Test'
+            },
+            'year' : 2021,
+            'records' : 10000,
+            'method' : 'hacking',
+            'sources' : ['https://example.com/' + 'a' * 300]
+        }
+        response = self.client.post(create_url, [data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('sources', response.data[0])
+        response = self.client.post(create_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('sources', response.data)
+        self.assertFalse(Source.objects.filter(url=data['sources'][0]).exists())
+        self.assertEqual(DataBreach.objects.count(), 2)
+
+    # verify the api key on every request so both requests run the same queries
+    @override_settings(DATA_BREACHES_CACHE={'API_KEY_TIMEOUT' : 0})
+    def test_create_list(self):
+        """Testing create action of /databreaches endpoint with a list of data
+        breaches. The amount of queries should not depend on the size of the list
+        and an invalid item should prevent the whole list from being created.
+        """
+        def databreaches(amount, offset=0):
+            return [
+                {
+                    'entity' : {
+                        'name' : 'Entity ' + str(offset) + '-' + str(i % 3),
+                        'organization_type' : ['web', 'retail']
+                    },
+                    'year' : 2020,
+                    'records' : 1000 + i,
+                    'method' : 'hacked',
+                    'sources' : ['https://example.com/' + str(i)]
+                }
+                for i in range(offset, offset + amount)
+            ]
+
+        # organization types are shared, both lists only link the existing ones
+        OrganizationType.objects.bulk_create([OrganizationType(organization_type=t) for t in ['web', 'retail']])
+        data = databreaches(3)
+        with CaptureQueriesContext(connection) as small_list:
+            response = self.client.post(self.list_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        for i in range(len(data)):
+            self.assertTrue(self.compareDataBreaches(data[i], response.data[i]), str(response.data[i]))
+
+        data = databreaches(30, offset=3)
+        with CaptureQueriesContext(connection) as big_list:
+            response = self.client.post(self.list_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(len(response.data), 30)
+        self.assertEqual(len(big_list), len(small_list))
+        self.assertEqual(DataBreach.objects.count(), 33)
+        self.assertEqual(Entity.objects.count(), 6)
+        self.assertEqual(EntityOrganizationType.objects.count(), 12)
+        self.assertEqual(Source.objects.count(), 33)
+
+        # invalid items
+        data = databreaches(3, offset=33)
+        data[1]['year'] = 1900
+        data[2]['sources'] = ['not an url']
+        response = self.client.post(self.list_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('year', response.data[1])
+        self.assertEqual(DataBreach.objects.count(), 33)
+
+        data = databreaches(3, offset=33)
+        data[2]['sources'] = ['not an url']
+        response = self.client.post(self.list_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('sources', response.data[2])
+        self.assertEqual(DataBreach.objects.count(), 33)
+
     def test_update(self):
         """Test update of data breaches data. Cover the cases below:
             * Valid update
@@ -231,6 +335,1251 @@ class DataBreachTestCase(APITestCase):
             response = self.client.delete(delete_url)
             self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT, response.data)
 
+    def test_delete_query_count(self):
+        """Deleting a data breach should delete its sources with a single query,
+        no matter how many sources it has, and keep its entity.
+        """
+        self.createDataBreaches(2)
+        small, big = DataBreach.objects.order_by('id')
+        for i in range(20):
+            big.sources.add(Source.objects.create(url='https://example.com/more/' + str(i)))
+
+        # the api key is verified and cached on the first write
+        self.client.post(reverse('databreaches-bulk-delete'), {}, format='json')
+        query_counts = []
+        for databreach in [small, big]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.delete(reverse('databreaches-detail', args=[databreach.id]))
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(Source.objects.count(), 0)
+        self.assertEqual(Entity.objects.count(), 2)
+
+    def test_bulk_delete(self):
+        """Bulk delete should delete the data breaches selected by ids or by a
+        filter, their sources and the entities left without data breaches, with
+        the same amount of queries no matter how many are deleted.
+        """
+        self.createDataBreaches(6)
+        shared = Entity.objects.get(name='Entity 0')
+        DataBreach.objects.create(entity=shared, year=2021, records=10, method='hacked')
+        ids = list(DataBreach.objects.filter(year=2020).order_by('id').values_list('id', flat=True))
+        bulk_delete_url = reverse('databreaches-bulk-delete')
+
+        response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        response = self.client.post(bulk_delete_url, {'ids' : ids[:1] + [999999]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        # the entity still has a data breach
+        self.assertEqual(response.data, {
+            'databreaches' : 1,
+            'sources' : 2,
+            'entities' : 0,
+            'organization_types' : 0,
+            'missing' : [999999],
+        })
+        self.assertTrue(Entity.objects.filter(id=shared.id).exists())
+
+        with CaptureQueriesContext(connection) as small_delete:
+            response = self.client.post(bulk_delete_url, {'ids' : ids[1:2]}, format='json')
+        self.assertEqual(response.data['entities'], 1)
+        with CaptureQueriesContext(connection) as big_delete:
+            response = self.client.post(bulk_delete_url, {'ids' : ids[2:4]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data['databreaches'], 2)
+        self.assertEqual(response.data['entities'], 2)
+        # the organization types are still used by other entities
+        self.assertEqual(response.data['organization_types'], 0)
+        self.assertEqual(len(big_delete), len(small_delete))
+
+        response = self.client.post(bulk_delete_url, {'filter' : {'entity' : 'Entity 4'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data['databreaches'], 1)
+        self.assertFalse(DataBreach.objects.filter(entity__name='Entity 4').exists())
+        self.assertFalse(Entity.objects.filter(name='Entity 4').exists())
+        self.assertEqual(DataBreach.objects.count(), 2)
+        self.assertEqual(Source.objects.count(), 2)
+
+        response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['results']), 2)
+
+        # invalid selections delete nothing
+        for data in [
+            {},
+            {'ids' : []},
+            {'ids' : ids, 'filter' : {'year' : 2020}},
+            {'filter' : {}},
+            {'filter' : {'entity' : ''}},
+            {'filter' : {'yaer' : 2020}},
+            {'filter' : {'year' : 'last'}},
+        ]:
+            response = self.client.post(bulk_delete_url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+        self.assertEqual(DataBreach.objects.count(), 2)
+
+        self.client.credentials()
+        response = self.client.post(bulk_delete_url, {'ids' : ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_update(self):
+        """Bulk update should change the data breaches of a list of partial
+        updates or of a filter in a single transaction, keep their stored
+        representation up to date and report the status of each one.
+        """
+        self.createDataBreaches(4)
+        refresh_representations(DataBreach.objects.all())
+        ids = list(DataBreach.objects.order_by('id').values_list('id', flat=True))
+        bulk_update_url = reverse('databreaches-bulk-update')
+
+        response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        response = self.client.patch(bulk_update_url, [
+            {'id' : ids[0], 'method' : 'poor security'},
+            {'id' : ids[1], 'year' : 2019, 'records' : 5},
+            {'id' : ids[2], 'method' : 'hacked'},
+            {'id' : 999999, 'year' : 2019},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data, {
+            'updated' : 2,
+            'unchanged' : 1,
+            'not_found' : 1,
+            'results' : [
+                {'id' : ids[0], 'status' : 'updated'},
+                {'id' : ids[1], 'status' : 'updated'},
+                {'id' : ids[2], 'status' : 'unchanged'},
+                {'id' : 999999, 'status' : 'not_found'},
+            ],
+        })
+        databreach = DataBreach.objects.get(id=ids[1])
+        self.assertEqual((databreach.year, databreach.records, databreach.method), (2019, 5, 'hacked'))
+        self.assertEqual(databreach.representation, make_representation(
+            'Entity 1', ['web', 'retail'], 2019, 5, 'hacked', ['https://example.com/1/a', 'https://example.com/1/b']
+        ))
+        self.assertEqual(DataBreach.objects.get(id=ids[0]).representation['method'], 'poor security')
+
+        response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][1]['year'], 2019)
+
+        with CaptureQueriesContext(connection) as small_update:
+            response = self.client.patch(bulk_update_url, {'ids' : ids[:1], 'values' : {'records' : 1}}, format='json')
+        small_update = len(small_update)
+        self.assertEqual(response.data['updated'], 1)
+        with CaptureQueriesContext(connection) as big_update:
+            response = self.client.patch(
+                bulk_update_url, {'filter' : {'method' : 'hacked'}, 'values' : {'records' : 2}}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(len(big_update), small_update)
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual([result['id'] for result in response.data['results']], ids[1:])
+        self.assertEqual(DataBreach.objects.filter(records=2).count(), 3)
+
+        # invalid updates change nothing
+        for data in [
+            [],
+            [{'id' : ids[0]}],
+            [{'id' : ids[0], 'yaer' : 2019}],
+            [{'id' : ids[0], 'year' : 'last'}],
+            [{'year' : 2019}],
+            [{'id' : ids[0], 'year' : 2019}, {'id' : ids[0], 'records' : 1}],
+            [{'id' : ids[0], 'year' : 2018}, {'id' : ids[1], 'records' : -1}],
+            {'ids' : ids},
+            {'ids' : ids, 'values' : {}},
+            {'filter' : {'yaer' : 2020}, 'values' : {'year' : 2018}},
+        ]:
+            response = self.client.patch(bulk_update_url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+        self.assertFalse(DataBreach.objects.filter(year=2018).exists())
+
+        # filters selecting more data breaches than a bulk update takes are refused
+        with mock.patch('data_breaches.views.MAX_BULK_SIZE', 2):
+            response = self.client.patch(
+                bulk_update_url, {'filter' : {'method' : 'hacked'}, 'values' : {'year' : 2018}}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('filter', response.data)
+        self.assertFalse(DataBreach.objects.filter(year=2018).exists())
+
+        self.client.credentials()
+        response = self.client.patch(bulk_update_url, {'ids' : ids, 'values' : {'year' : 2018}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_entity_update(self):
+        """Updating an entity should only write the organization types added or
+        removed, with one query each, write nothing when nothing changed and
+        keep the representation of its data breaches up to date.
+        """
+        self.createDataBreaches(1)
+        entity = Entity.objects.get(name='Entity 0')
+        databreach = DataBreach.objects.get(entity=entity)
+
+        def update(name, org_types):
+            serializer = EntitySerializer(entity, data={'name' : name}, context={'extra' : {'organization_type' : org_types}})
+            serializer.is_valid(raise_exception=True)
+            with CaptureQueriesContext(connection) as queries:
+                serializer.save()
+            # ignore the savepoints of the transaction
+            return [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+
+        queries = update('Entity 0', ['retail', 'web'])
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].startswith('SELECT'))
+
+        queries = update('Entity 0', ['web', 'gaming', 'gaming'])
+        # the removed link and the organization type no entity acts in anymore
+        self.assertEqual(len([sql for sql in queries if sql.startswith('DELETE')]), 2)
+        self.assertEqual(len([sql for sql in queries if sql.startswith('INSERT INTO "data_breaches_entityorganizationtype"')]), 1)
+        self.assertEqual(
+            sorted(entity.organization_types.values_list('organization_type', flat=True)), ['gaming', 'web']
+        )
+        self.assertFalse(OrganizationType.objects.filter(organization_type='retail').exists())
+        databreach.refresh_from_db()
+        self.assertEqual(databreach.representation['entity'], {'name' : 'Entity 0', 'organization_type' : ['web', 'gaming']})
+
+        # an empty list keeps the organization types
+        update('Entity 00', [])
+        databreach.refresh_from_db()
+        self.assertEqual(databreach.representation['entity'], {'name' : 'Entity 00', 'organization_type' : ['web', 'gaming']})
+
+        # organization types are stripped like the other fields
+        queries = update('Entity 00', [' web', 'gaming\n'])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(OrganizationType.objects.filter(organization_type__in=['web', 'gaming']).count(), 2)
+        self.assertEqual(OrganizationType.objects.count(), 2)
+
+        for org_types in [['x' * 31], [' ']]:
+            with self.assertRaises(ValidationError):
+                update('Entity 00', org_types)
+        self.assertEqual(entity.organization_types.count(), 2)
+
+    def test_sparse_fields(self):
+        """The fields and expand query parameters should return only the chosen
+        fields and relations, without reading the stored representation when no
+        relation is expanded.
+        """
+        self.createDataBreaches(3)
+        refresh_representations(DataBreach.objects.all())
+        full = self.client.get(self.list_url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.list_url, {'fields' : 'id,entity.name,year,records'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        # besides the data version, a single query without the representation
+        queries = [query['sql'] for query in queries if 'data_breaches_databreach' in query['sql']]
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('representation', queries[0])
+        self.assertEqual(response.data['results'][0], {
+            'id' : full.data['results'][0]['id'],
+            'entity' : {'name' : 'Entity 0'},
+            'year' : 2020,
+            'records' : 1000,
+        })
+        self.assertLess(len(response.content), len(full.content) / 2)
+
+        response = self.client.get(self.list_url, {'fields' : 'records,id', 'expand' : 'sources'})
+        self.assertEqual(list(response.data['results'][1]), ['id', 'records', 'sources'])
+        self.assertEqual(response.data['results'][1]['sources'], ['https://example.com/1/a', 'https://example.com/1/b'])
+
+        response = self.client.get(self.list_url, {'expand' : 'organization_type'})
+        self.assertEqual(response.data['results'][2], {
+            'id' : full.data['results'][2]['id'],
+            'entity' : {'name' : 'Entity 2', 'organization_type' : ['web', 'retail']},
+            'year' : 2020,
+            'records' : 1002,
+            'method' : 'hacked',
+        })
+
+        detail_url = reverse('databreaches-detail', args=[full.data['results'][0]['id']])
+        response = self.client.get(detail_url, {'fields' : 'method'})
+        self.assertEqual(response.data, {'method' : 'hacked'})
+        response = self.client.get(detail_url, {'fields' : 'id', 'expand' : 'organization_type,sources'})
+        self.assertEqual(response.data, {
+            'id' : full.data['results'][0]['id'],
+            'entity' : {'organization_type' : ['web', 'retail']},
+            'sources' : ['https://example.com/0/a', 'https://example.com/0/b'],
+        })
+
+        for params in [{'fields' : 'id,name'}, {'expand' : 'entity'}, {'fields' : 'id', 'expand' : 'year'}]:
+            response = self.client.get(self.list_url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_batch(self):
+        """The batch action should return the data breaches asked for keyed by
+        id, in order, with the missing ids, and run the same amount of queries
+        no matter how many are asked for.
+        """
+        self.createDataBreaches(5)
+        ids = list(DataBreach.objects.order_by('id').values_list('id', flat=True))
+        batch_url = reverse('databreaches-batch')
+        self.client.credentials()
+
+        with CaptureQueriesContext(connection) as small_batch:
+            response = self.client.get(batch_url, {'ids' : str(ids[0])})
+        small_batch = len(small_batch)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+
+        with CaptureQueriesContext(connection) as big_batch:
+            response = self.client.get(batch_url, {'ids' : '%d,%d,999999,%d,%d' % (ids[3], ids[1], ids[2], ids[3])})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(len(big_batch), small_batch)
+        self.assertEqual(list(response.data['results']), [str(ids[3]), str(ids[1]), str(ids[2])])
+        self.assertEqual(response.data['missing'], [999999])
+        detail = self.client.get(reverse('databreaches-detail', args=[ids[1]]))
+        self.assertEqual(response.data['results'][str(ids[1])], detail.data)
+
+        response = self.client.get(batch_url, {'ids' : '%d,%d' % (ids[0], ids[1])})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        response = self.client.get(batch_url, {'ids' : '%d,%d' % (ids[0], ids[1])})
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        response = self.client.post(batch_url + '?fields=id,year', {'ids' : ids + [999998]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data['results'][str(ids[4])], {'id' : ids[4], 'year' : 2020})
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(response.data['missing'], [999998])
+
+        with self.settings(DATA_BREACHES_CACHE={'ENABLED' : False}):
+            for params in [{}, {'ids' : ''}, {'ids' : '1,a'}, {'ids' : '0'}, {'ids' : '1', 'fields' : 'name'}]:
+                response = self.client.get(batch_url, params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        for data in [{}, {'ids' : []}, {'ids' : 1}, {'ids' : list(range(1, 1002))}]:
+            response = self.client.post(batch_url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+        with self.settings(DATA_BREACHES_MAX_BATCH_SIZE=2):
+            response = self.client.post(batch_url, {'ids' : ids[:3]}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('ids', response.data)
+            response = self.client.post(batch_url, {'ids' : ids[:2]}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_shared_organization_types(self):
+        """Organization types should be stored once and shared by the entities,
+        and linking them through the orm should clear the stored
+        representations of the data breaches of the entity.
+        """
+        self.createDataBreaches(3)
+        self.assertEqual(OrganizationType.objects.count(), 2)
+        self.assertEqual(EntityOrganizationType.objects.count(), 6)
+        refresh_representations(DataBreach.objects.all())
+
+        entity = Entity.objects.get(name='Entity 1')
+        entity.organization_types.add(OrganizationType.objects.create(organization_type='gaming'))
+        self.assertEqual(list(DataBreach.objects.filter(representation__isnull=True).values_list('entity__name', flat=True)), ['Entity 1'])
+        response = self.client.get(self.list_url, {'organization_type' : 'gaming'})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['entity']['organization_type'], ['web', 'retail', 'gaming'])
+
+        # deleting entities keeps the organization types other entities act in
+        response = self.client.post(reverse('databreaches-bulk-delete'), {'filter' : {'entity' : 'Entity 1'}}, format='json')
+        self.assertEqual(response.data['organization_types'], 1)
+        self.assertEqual(EntityOrganizationType.objects.count(), 4)
+        self.assertEqual(
+            sorted(OrganizationType.objects.values_list('organization_type', flat=True)), ['retail', 'web']
+        )
+
+        response = self.client.post(reverse('databreaches-bulk-delete'), {'filter' : {'organization_type' : 'web'}}, format='json')
+        self.assertEqual((response.data['entities'], response.data['organization_types']), (2, 2))
+        self.assertFalse(OrganizationType.objects.exists())
+
+    def test_shared_sources(self):
+        """Source urls should be stored once and shared by the data breaches
+        citing them, listed by the by source lookup and deleted once no data
+        breach cites them.
+        """
+        shared = 'https://example.com/shared'
+        data = [
+            {
+                'entity' : {'name' : 'Entity ' + str(i), 'organization_type' : ['web']},
+                'year' : 2020,
+                'records' : 1000 + i,
+                'method' : 'hacked',
+                'sources' : [shared, 'https://example.com/' + str(i), shared]
+            }
+            for i in range(2)
+        ]
+        response = self.client.post(self.list_url, data[0], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data['sources'], [shared, 'https://example.com/0'])
+        response = self.client.post(self.list_url, data[1:], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(Source.objects.count(), 3)
+        self.assertEqual(Source.objects.get(url=shared).databreaches.count(), 2)
+
+        by_source_url = reverse('databreaches-by-source')
+        response = self.client.get(by_source_url, {'url' : shared})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual([dt['records'] for dt in response.data['results']], [1000, 1001])
+        response = self.client.get(by_source_url, {'url' : 'https://example.com/1', 'fields' : 'id,records'})
+        self.assertEqual(response.data['results'], [{'id' : DataBreach.objects.get(records=1001).id, 'records' : 1001}])
+        response = self.client.get(by_source_url, {'url' : 'https://example.com/none'})
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get(by_source_url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.list_url, {'source' : 'https://example.com/0'})
+        self.assertEqual([dt['records'] for dt in response.data['results']], [1000])
+
+        # changing a shared source clears the representations citing it
+        Source.objects.filter(url=shared).get().save()
+        self.assertEqual(DataBreach.objects.filter(representation__isnull=True).count(), 2)
+
+        # sources are deleted with the last data breach citing them
+        self.client.post(reverse('databreaches-bulk-delete'), {'filter' : {'entity' : 'Entity 0'}}, format='json')
+        self.assertEqual(sorted(Source.objects.values_list('url', flat=True)), ['https://example.com/1', shared])
+        self.client.post(reverse('databreaches-bulk-delete'), {'filter' : {'entity' : 'Entity 1'}}, format='json')
+        self.assertEqual(Source.objects.count(), 0)
+
+    def createDataBreaches(self, amount, offset=0):
+        """Create data breaches directly on the database, each one with its
+        own entity, two organization types and two sources.
+
+        Args:
+            amount (int) : amount of data breaches to create.
+            offset (int) : number used to keep entity names unique between calls.
+        """
+        for i in range(offset, offset + amount):
+            entity = Entity.objects.create(name='Entity ' + str(i))
+            for org_type in ['web', 'retail']:
+                entity.organization_types.add(OrganizationType.objects.get_or_create(organization_type=org_type)[0])
+            databreach = DataBreach.objects.create(entity=entity, year=2020, records=1000 + i, method='hacked')
+            for suffix in ['a', 'b']:
+                databreach.sources.add(Source.objects.create(url='https://example.com/' + str(i) + '/' + suffix))
+
+    def test_list_query_count(self):
+        """Listing data breaches should run the same amount of queries no matter
+        how many data breaches are listed.
+        """
+        self.createDataBreaches(2)
+        with CaptureQueriesContext(connection) as small_list:
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+
+        self.createDataBreaches(20, offset=2)
+        with CaptureQueriesContext(connection) as big_list:
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(len(results), 22)
+        self.assertEqual(len(big_list), len(small_list))
+        self.assertEqual(results[0]['entity']['organization_type'], ['web', 'retail'])
+        self.assertEqual(len(results[0]['sources']), 2)
+
+    def test_representation(self):
+        """Data breaches should store their representation when written through
+        the api or the importers, so list and detail only read the DataBreach
+        table. Changes made through the orm clear it until it is rebuilt.
+        """
+        self.createDataBreaches(2)
+        self.assertFalse(DataBreach.objects.filter(representation__isnull=False).exists())
+        expected = self.client.get(self.list_url).data['results']
+
+        out = StringIO()
+        call_command('rebuild_representations', stdout=out)
+        self.assertIn('Rebuilt 2 data breaches representations', out.getvalue())
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.data['results'], expected)
+        for query in queries:
+            self.assertNotIn('source', query['sql'])
+            self.assertNotIn('organizationtype', query['sql'])
+
+        # api writes
+        data = {
+            'entity' : {'name' : 'Entity 0', 'organization_type' : ['web', 'retail']},
+            'year' : 2021,
+            'records' : 10000,
+            'method' : 'hacking',
+            'sources' : ['https://example.com/new']
+        }
+        response = self.client.post(self.list_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        databreach = DataBreach.objects.get(id=response.data['id'])
+        self.assertEqual(databreach.representation, {k: v for k, v in response.data.items() if k != 'id'})
+
+        response = self.client.patch(
+            reverse('databreaches-detail', args=[databreach.id]), {'year' : 2022}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        databreach.refresh_from_db()
+        self.assertEqual(databreach.representation['year'], 2022)
+
+        # a bulk insert adding an organization type refreshes the data breaches of the entity
+        data['entity']['organization_type'] = ['bank']
+        response = self.client.post(self.list_url, [data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        for databreach in DataBreach.objects.filter(entity__name='Entity 0'):
+            self.assertEqual(databreach.representation['entity']['organization_type'], ['web', 'retail', 'bank'])
+
+        # orm writes
+        databreach = DataBreach.objects.get(entity__name='Entity 1')
+        databreach.sources.add(Source.objects.create(url='https://example.com/orm'))
+        databreach.refresh_from_db()
+        self.assertIsNone(databreach.representation)
+        response = self.client.get(reverse('databreaches-detail', args=[databreach.id]))
+        self.assertIn('https://example.com/orm', response.data['sources'])
+
+        call_command('rebuild_representations', '--missing', stdout=out)
+        self.assertIn('Rebuilt 1 data breaches representations', out.getvalue())
+        databreach.refresh_from_db()
+        self.assertIn('https://example.com/orm', databreach.representation['sources'])
+
+        # queryset updates send no signals but clear the representations too
+        detail_url = reverse('databreaches-detail', args=[databreach.id])
+        for write, field, value in [
+            (lambda: DataBreach.objects.filter(id=databreach.id).update(year=2010), 'year', 2010),
+            (lambda: DataBreach.objects.bulk_update([DataBreach(id=databreach.id, records=5)], ['records']), 'records', 5),
+            (lambda: Entity.objects.filter(id=databreach.entity_id).update(name='Renamed'), 'entity', {'name' : 'Renamed', 'organization_type' : ['web', 'retail']}),
+        ]:
+            self.client.get(detail_url)
+            write()
+            self.assertIsNone(DataBreach.objects.get(id=databreach.id).representation)
+            response = self.client.get(detail_url)
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertEqual(response.data[field], value)
+            call_command('rebuild_representations', '--missing', stdout=out)
+
+    def test_list_pagination(self):
+        """Testing cursor pagination of the /databreaches endpoint. Following the
+        `next` links should visit every data breach once, in order, running the
+        same amount of queries on every page.
+        """
+        self.createDataBreaches(7)
+        ids = list(DataBreach.objects.order_by('id').values_list('id', flat=True))
+
+        visited = []
+        query_counts = []
+        url = self.list_url + '?page_size=2'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            visited += [dt['id'] for dt in response.data['results']]
+            query_counts.append(len(queries))
+            url = response.data['next']
+        self.assertEqual(visited, ids)
+        self.assertEqual(len(set(query_counts)), 1)
+
+        # going back from the last page
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([dt['id'] for dt in response.data['results']], ids[4:6])
+
+        # the page sizes follow the settings
+        with self.settings(DATA_BREACHES_PAGE_SIZE=3, DATA_BREACHES_MAX_PAGE_SIZE=4, DATA_BREACHES_CACHE={'ENABLED' : False}):
+            response = self.client.get(self.list_url)
+            self.assertEqual(len(response.data['results']), 3)
+            response = self.client.get(self.list_url + '?page_size=6')
+            self.assertEqual(len(response.data['results']), 4)
+
+    def test_list_filters(self):
+        """Testing filters of the /databreaches list on year, method, records,
+        entity name and organization type.
+        """
+        self.createDataBreaches(5)
+        DataBreach.objects.filter(entity__name='Entity 0').update(year=2010, method='lost device')
+        Entity.objects.get(name='Entity 4').organization_types.add(OrganizationType.objects.create(organization_type='healthcare'))
+
+        cases = [
+            ('year=2010', ['Entity 0']),
+            ('year__gte=2015', ['Entity 1', 'Entity 2', 'Entity 3', 'Entity 4']),
+            ('year__lte=2015', ['Entity 0']),
+            ('method=lost%20device', ['Entity 0']),
+            ('records__gte=1002&records__lte=1003', ['Entity 2', 'Entity 3']),
+            ('entity=Entity%203', ['Entity 3']),
+            ('organization_type=healthcare', ['Entity 4']),
+            ('organization_type=web&year=2020', ['Entity 1', 'Entity 2', 'Entity 3', 'Entity 4']),
+        ]
+        for query, names in cases:
+            response = self.client.get(self.list_url + '?' + query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, query)
+            self.assertEqual([dt['entity']['name'] for dt in response.data['results']], names, query)
+
+    def test_search(self):
+        """The `search` filter should find data breaches by words starting the
+        entity name or a source url, and `autocomplete` should complete entity
+        names, names starting with the query first.
+        """
+        def search(query):
+            response = self.client.get(self.list_url, {'search' : query})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(dt['entity']['name'] for dt in response.data['results'])
+
+        for name, url in [
+            ('Yahoo Japan', 'https://news.example.com/yahoo-japan'),
+            ('Nestlé Group', 'https://www.nytimes.com/nestle'),
+            ('Japan Airlines', 'https://example.org/jal'),
+        ]:
+            entity = Entity.objects.create(name=name)
+            databreach = DataBreach.objects.create(entity=entity, year=2020, records=1000, method='hacked')
+            databreach.sources.add(Source.objects.create(url=url))
+
+        self.assertEqual(search('yah'), ['Yahoo Japan'])
+        self.assertEqual(search('japan'), ['Japan Airlines', 'Yahoo Japan'])
+        self.assertEqual(search('jap air'), ['Japan Airlines'])
+        self.assertEqual(search('nestle'), ['Nestlé Group'])
+        self.assertEqual(search('nytimes'), ['Nestlé Group'])
+        self.assertEqual(search('"japan* OR'), [])
+        self.assertEqual(len(search('')), 3)
+
+        # the index follows changes
+        entity = Entity.objects.get(name='Japan Airlines')
+        entity.name = 'JAL Group'
+        entity.save()
+        self.assertEqual(search('japan'), ['Yahoo Japan'])
+        self.assertEqual(search('group'), ['JAL Group', 'Nestlé Group'])
+
+        autocomplete_url = reverse('databreaches-autocomplete')
+        Entity.objects.create(name='Group One')
+        response = self.client.get(autocomplete_url, {'q' : 'gro'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0], 'Group One')
+        self.assertEqual(sorted(response.data[1:]), ['JAL Group', 'Nestlé Group'])
+        response = self.client.get(autocomplete_url, {'q' : 'gro', 'limit' : 2})
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(self.client.get(autocomplete_url, {'q' : ''}).data, [])
+        response = self.client.get(autocomplete_url, {'q' : 'gro', 'limit' : 'a'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cache(self):
+        """List and detail responses should be cached until data breaches data
+        changes.
+        """
+        self.createDataBreaches(2)
+        detail_url = reverse('databreaches-detail', args=[DataBreach.objects.first().id])
+        for url in [self.list_url, self.list_url + '?year=2020', detail_url]:
+            response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'MISS')
+            # data version query
+            with self.assertNumQueries(1):
+                cached_response = self.client.get(url)
+            self.assertEqual(cached_response['X-Cache'], 'HIT')
+            self.assertEqual(cached_response.data, response.data)
+        self.assertEqual(get_stats(), {'hits' : 3, 'misses' : 3})
+
+        # changes through the api, the orm and bulk inserts invalidate the cache
+        data = dict(response.data, year=2021)
+        response = self.client.put(detail_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        response = self.client.get(detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['year'], 2021)
+
+        DataBreach.objects.get(id=response.data['id']).sources.add(Source.objects.create(url='https://example.com/new'))
+        response = self.client.get(detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('https://example.com/new', response.data['sources'])
+
+        self.client.get(self.list_url)
+        data = {
+            'entity' : {'name' : 'Test'},
+            'year' : 2021,
+            'records' : 10000,
+            'method' : 'hacking',
+            'sources' : []
+        }
+        self.client.post(self.list_url, [data], format='json')
+        response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['results']), 3)
+
+        with override_settings(DATA_BREACHES_CACHE={'ENABLED' : False}):
+            response = self.client.get(self.list_url)
+            self.assertNotIn('X-Cache', response)
+
+    def test_conditional_get(self):
+        """List and detail responses should have ETag and Last-Modified headers
+        and requests with matching If-None-Match or If-Modified-Since headers
+        should get a 304 response until data breaches data changes.
+        """
+        self.createDataBreaches(2)
+        detail_url = reverse('databreaches-detail', args=[DataBreach.objects.first().id])
+        for url in [self.list_url, detail_url]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response['ETag']
+            last_modified = response['Last-Modified']
+
+            # data version query
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(len(response.content), 0)
+
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        DataBreach.objects.first().sources.add(Source.objects.create(url='https://example.com/new'))
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_stats(self):
+        """Testing statistics of data breaches by year, method, organization type
+        and top entities, computed with a constant amount of queries.
+        """
+        stats_url = reverse('databreaches-stats')
+        response = self.client.get(stats_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], {'count' : 0, 'total_records' : 0, 'max_records' : None})
+
+        self.createDataBreaches(3)
+        DataBreach.objects.filter(entity__name='Entity 0').update(year=2010, method='lost device')
+        Entity.objects.get(name='Entity 2').organization_types.add(OrganizationType.objects.create(organization_type='healthcare'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(stats_url + '?top=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], {'count' : 3, 'total_records' : 3003, 'max_records' : 1002})
+        self.assertEqual(response.data['by_year'], [
+            {'year' : 2010, 'count' : 1, 'total_records' : 1000, 'max_records' : 1000},
+            {'year' : 2020, 'count' : 2, 'total_records' : 2003, 'max_records' : 1002},
+        ])
+        self.assertEqual(response.data['by_method'], [
+            {'method' : 'hacked', 'count' : 2, 'total_records' : 2003, 'max_records' : 1002},
+            {'method' : 'lost device', 'count' : 1, 'total_records' : 1000, 'max_records' : 1000},
+        ])
+        self.assertEqual(response.data['by_organization_type'], [
+            {'organization_type' : 'retail', 'count' : 3, 'total_records' : 3003, 'max_records' : 1002},
+            {'organization_type' : 'web', 'count' : 3, 'total_records' : 3003, 'max_records' : 1002},
+            {'organization_type' : 'healthcare', 'count' : 1, 'total_records' : 1002, 'max_records' : 1002},
+        ])
+        self.assertEqual([e['entity'] for e in response.data['top_entities']], ['Entity 2', 'Entity 1'])
+
+        # filters apply to statistics
+        response = self.client.get(stats_url + '?year=2020')
+        self.assertEqual(response.data['total']['count'], 2)
+
+        self.createDataBreaches(10, offset=3)
+        with CaptureQueriesContext(connection) as more_queries:
+            response = self.client.get(stats_url + '?top=2')
+        self.assertEqual(response.data['total']['count'], 13)
+        self.assertEqual(len(more_queries), len(queries))
+
+        response = self.client.get(stats_url + '?top=a')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export(self):
+        """Testing streamed export of data breaches as ndjson and csv."""
+        self.createDataBreaches(5)
+        export_url = reverse('databreaches-export')
+        expected = self.client.get(self.list_url).data['results']
+
+        response = self.client.get(export_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+        response = self.client.get(export_url + '?format=csv&records__gte=1003')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'entity', 'organization_type', 'year', 'records', 'method', 'sources'])
+        self.assertEqual(rows[1], [
+            str(expected[3]['id']),
+            'Entity 3',
+            'web|retail',
+            '2020',
+            '1003',
+            'hacked',
+            'https://example.com/3/a https://example.com/3/b'
+        ])
+        self.assertEqual(len(rows), 3)
+
+        response = self.client.get(export_url + '?format=xml')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_api_key_cache(self):
+        """Verified api keys should be cached on shared caches until they are
+        revoked or expire.
+        """
+        data = {
+            'entity' : {'name' : 'Test'},
+            'year' : 2021,
+            'records' : 10000,
+            'method' : 'hacking',
+            'sources' : []
+        }
+        # keys are verified on every request with per process caches
+        for i in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.list_url, [data], format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertTrue([q for q in queries if 'rest_framework_api_key' in q['sql']])
+
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        shared_cache = override_settings(CACHES={
+            'default' : {'BACKEND' : 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION' : location}
+        })
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+        data = {
+            'entity' : {'name' : 'Test'},
+            'year' : 2021,
+            'records' : 10000,
+            'method' : 'hacking',
+            'sources' : []
+        }
+        response = self.client.post(self.list_url, [data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # the api key is not queried again
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.list_url, [data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse([q for q in queries if 'rest_framework_api_key' in q['sql']])
+
+        # a wrong secret with the same prefix is not accepted
+        prefix = self.api_key.partition('.')[0]
+        self.client.credentials(HTTP_AUTHORIZATION='Api-Key ' + prefix + '.wrong')
+        response = self.client.post(self.list_url, [data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        # revoked api keys are removed from the cache
+        self.client.credentials(HTTP_AUTHORIZATION='Api-Key ' + str(self.api_key))
+        self.api_key_obj.revoked = True
+        self.api_key_obj.save()
+        response = self.client.post(self.list_url, [data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        # expired api keys are refused even when cached
+        api_key_obj, api_key = APIKey.objects.create_key(
+            name='Expiring APIKey',
+            expiry_date=timezone.now() + timedelta(seconds=30)
+        )
+        self.client.credentials(HTTP_AUTHORIZATION='Api-Key ' + api_key)
+        response = self.client.post(self.list_url, [data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        APIKey.objects.filter(pk=api_key_obj.pk).update(expiry_date=timezone.now() - timedelta(seconds=1))
+        with mock.patch('data_breaches.permissions.timezone.now', return_value=timezone.now() + timedelta(minutes=1)):
+            response = self.client.post(self.list_url, [data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class MetricsTestCase(APITestCase):
+    """Test case for the request metrics of the api project."""
+    def setUp(self):
+        registry.clear()
+        cache.clear()
+        for i in range(3):
+            entity = Entity.objects.create(name='Entity ' + str(i))
+            DataBreach.objects.create(entity=entity, year=2020, records=1000 + i, method='hacked')
+
+    @override_settings(API_METRICS={'QUERY_COUNT_HEADER' : True})
+    def test_metrics(self):
+        """Requests should be recorded by route and method with their queries,
+        and the query count header should match the queries run.
+        """
+        list_url = reverse('databreaches-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(list_url)
+        list_queries = len(queries)
+        self.assertEqual(response['X-DB-Query-Count'], str(list_queries))
+        # cached, only the data version is read
+        self.client.get(list_url)
+        b''.join(self.client.get(reverse('databreaches-export')).streaming_content)
+        self.client.get('/api/missing/')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        metrics = response.content.decode()
+        labels = '{route="databreaches-list",method="GET"}'
+        self.assertIn('http_requests_total{route="databreaches-list",method="GET",status="200"} 2', metrics)
+        self.assertIn('http_request_duration_seconds_count' + labels + ' 2', metrics)
+        self.assertIn('http_request_db_queries_sum' + labels + ' ' + str(list_queries + 1), metrics)
+        self.assertIn('http_response_size_bytes_count' + labels + ' 2', metrics)
+        self.assertIn('http_request_db_queries_count{route="databreaches-export",method="GET"} 1', metrics)
+        self.assertIn('http_requests_total{route="unmatched",method="GET",status="404"} 1', metrics)
+        self.assertIn('data_breaches_cache_hits_total 1', metrics)
+
+        with override_settings(API_METRICS={'QUERY_COUNT_HEADER' : False}):
+            self.assertNotIn('X-DB-Query-Count', self.client.get(list_url))
+
+class PopulateDbTestCase(APITestCase):
+    """Test case for the populate_db management command."""
+    data = [
+        {
+            "entity": {
+                "name": "21st Century Oncology",
+                "organization_type": ["healthcare"]
+            },
+            "year": 2016,
+            "records": 2200000,
+            "method": "hacked",
+            "sources": [
+                "https://gizmodo.com/mother-of-all-breaches-exposes-773-million-emails-21-m-1831833456",
+                "http://cbs12.com/news/local/21st-century-oncology-notifies-22-million-of-hacking-data-breach"
+            ]
+        },
+        {
+            "entity": {
+                "name": "21st Century Oncology",
+                "organization_type": ["healthcare", "medical"]
+            },
+            "year": 2019,
+            "records": 100,
+            "method": "poor security",
+            "sources": []
+        },
+        {
+            "entity": {
+                "name": "Invalid Year"
+            },
+            "year": 1900,
+            "records": 10,
+            "method": "hacked",
+            "sources": []
+        }
+    ]
+
+    def populate(self, *args, content=None):
+        """Run populate_db with `content`, `self.data` as a json array by default,
+        and return its output.
+        """
+        if content is None:
+            content = json.dumps(self.data, indent=4)
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as jsonf:
+            jsonf.write(content)
+            jsonf.flush()
+            out = StringIO()
+            call_command('populate_db', jsonf.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_load_representation(self):
+        """Loading data breaches one by one should store their representation,
+        and the one of the other data breaches of entities given new
+        organization types.
+        """
+        self.populate()
+        self.data[0]['entity']['organization_type'] = ['oncology']
+        self.populate('--batch-size', '1', content=json.dumps(self.data[:1]))
+        self.assertFalse(DataBreach.objects.filter(representation__isnull=True).exists())
+        for databreach in DataBreach.objects.all():
+            self.assertEqual(databreach.representation, build_representation(databreach))
+        self.assertEqual(
+            [d.representation['entity']['organization_type'] for d in DataBreach.objects.filter(year=2016)],
+            [['healthcare', 'medical', 'oncology']] * 2
+        )
+
+    def test_bulk(self):
+        """Bulk loading should import the valid data breaches, report the invalid
+        ones and not duplicate entities or organization types.
+        """
+        out = self.populate('--bulk')
+        self.assertIn('Imported 2 data breaches (1 failed)', out)
+        self.assertIn('Not possible to register databreach', out)
+        self.assertEqual(DataBreach.objects.count(), 2)
+        self.assertEqual(Entity.objects.count(), 1)
+        self.assertEqual(Source.objects.count(), 2)
+        self.assertEqual(
+            sorted(OrganizationType.objects.values_list('organization_type', flat=True)),
+            ['healthcare', 'medical']
+        )
+        databreach = DataBreach.objects.get(year=2016)
+        self.assertEqual(databreach.entity.name, '21st Century Oncology')
+        self.assertEqual(databreach.sources.count(), 2)
+
+    def test_invalidation(self):
+        """Cached responses should be invalidated once for every batch, both
+        when loading one by one and in bulk.
+        """
+        # the invalid data breach writes its entity when loaded one by one
+        for args, batches in [((), 3), (('--bulk',), 2)]:
+            version = DatasetVersion.objects.get(pk=1).version
+            self.populate('--batch-size', '1', *args)
+            self.assertEqual(DatasetVersion.objects.get(pk=1).version, version + batches)
+
+    def test_ndjson(self):
+        """Files with one data breach per line should be imported in batches."""
+        content = '\n'.join(json.dumps(dt) for dt in self.data) + '\n'
+        out = self.populate('--bulk', '--batch-size', '1', content=content)
+        self.assertIn('Loaded 1 data breaches (0 failed)', out)
+        self.assertIn('Imported 2 data breaches (1 failed)', out)
+        self.assertEqual(DataBreach.objects.count(), 2)
+
+        out = self.populate('--format', 'ndjson', content=content)
+        self.assertIn('Imported 2 data breaches (1 failed)', out)
+        self.assertEqual(DataBreach.objects.count(), 4)
+
+    def test_sync(self):
+        """Syncing should only create new data breaches, replace sources of the
+        changed ones and delete the missing ones when asked to.
+        """
+        self.data = self.data[:2]
+        out = self.populate('--sync')
+        self.assertIn('Synced: 2 created, 0 updated, 0 unchanged, 0 deleted.', out)
+
+        out = self.populate('--sync')
+        self.assertIn('Synced: 0 created, 0 updated, 2 unchanged, 0 deleted.', out)
+        self.assertEqual(DataBreach.objects.count(), 2)
+        self.assertEqual(Source.objects.count(), 2)
+
+        unchanged_id = DataBreach.objects.get(year=2016).id
+        self.data[1]['sources'] = ['https://example.com/new']
+        self.data.append({
+            "entity": {"name": "500px", "organization_type": ["social networking"]},
+            "year": 2020,
+            "records": 14870304,
+            "method": "hacked",
+            "sources": []
+        })
+        out = self.populate('--sync')
+        self.assertIn('Synced: 1 created, 1 updated, 1 unchanged, 0 deleted.', out)
+        self.assertEqual(DataBreach.objects.count(), 3)
+        self.assertEqual(
+            list(DataBreach.objects.get(year=2019).sources.values_list('url', flat=True)),
+            ['https://example.com/new']
+        )
+        self.assertEqual(DataBreach.objects.get(year=2016).id, unchanged_id)
+
+        del self.data[0]
+        out = self.populate('--sync', '--delete', '--batch-size', '1')
+        self.assertIn('Synced: 0 created, 0 updated, 2 unchanged, 1 deleted.', out)
+        self.assertFalse(DataBreach.objects.filter(id=unchanged_id).exists())
+        self.assertEqual(Source.objects.count(), 1)
+
+    def test_sync_delete_keeps_created(self):
+        """Data breaches created by a sync should not be deleted by its
+        --delete, and duplicates should be created whatever the batch size.
+        """
+        self.data = self.data[:2]
+        self.populate('--sync', content=json.dumps(self.data[:1]))
+        out = self.populate('--sync', '--delete')
+        self.assertIn('Synced: 1 created, 0 updated, 1 unchanged, 0 deleted.', out)
+        self.assertEqual(DataBreach.objects.count(), 2)
+
+        self.data.append(self.data[1])
+        for batch_size in ['1', '10']:
+            DataBreach.objects.filter(year=2019).delete()
+            out = self.populate('--sync', '--delete', '--batch-size', batch_size)
+            self.assertIn('Synced: 2 created, 0 updated, 1 unchanged, 0 deleted.', out)
+            self.assertEqual(DataBreach.objects.filter(year=2019).count(), 2)
+
+    def test_json_array_streaming(self):
+        """Items of a json array should be parsed incrementally, even when an
+        item is split between chunks.
+        """
+        content = json.dumps(self.data, indent=4)
+        for chunk_size in [1, 10, 1000]:
+            items = list(iter_json_array(StringIO(content), chunk_size=chunk_size))
+            self.assertEqual(items, self.data)
+
+        # items cut anywhere, in literals, numbers and escapes
+        items = [{'a' : True, 'b' : None, 'c' : [-1.5e3, False], 'd' : 'é "x" \\ \U0001f600'}] * 2
+        content = json.dumps(items)
+        for chunk_size in range(1, 12):
+            self.assertEqual(list(iter_json_array(StringIO(content), chunk_size=chunk_size)), items)
+
+        for content in ['{"entity" : {}}', '[{"year" : 2020}', '[{"year" : 2020},]', '[1 2]']:
+            with self.assertRaises(ValueError):
+                list(iter_json_array(StringIO(content), chunk_size=4))
+
+        # a malformed item is reported without reading the rest of the file
+        content = StringIO('[{"year" : 20x0}, ' + json.dumps(self.data * 1000)[1:])
+        with self.assertRaises(ValueError):
+            list(iter_json_array(content, chunk_size=100))
+        self.assertEqual(content.tell(), 100)
+
+        with self.assertRaises(CommandError):
+            self.populate('--format', 'json', content='{"year" : 2020}')
+
+class ImportJobTestCase(APITestCase):
+    """Test case for the import jobs endpoint and the run_import_jobs command."""
+    def setUp(self):
+        self.imports_url = reverse('imports-list')
+        self.api_key_obj, self.api_key = APIKey.objects.create_key(name='Testing APIKey')
+        self.client.credentials(HTTP_AUTHORIZATION='Api-Key ' + str(self.api_key))
+        cache.clear()
+
+    def run_jobs(self):
+        out = StringIO()
+        call_command('run_import_jobs', '--once', stdout=out)
+        return out.getvalue()
+
+    def test_import_job(self):
+        """Posting data breaches should store a job and return right away, the
+        worker should import them in batches and report the progress and the
+        errors of the invalid data breaches.
+        """
+        data = PopulateDbTestCase.data * 2
+        response = self.client.post(self.imports_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED, response.data)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertIsNone(response.data['throughput'])
+        self.assertEqual(DataBreach.objects.count(), 0)
+        status_url = response['Location']
+        ImportJob.objects.filter(id=response.data['id']).update(batch_size=2)
+        self.assertEqual(len(self.client.get(reverse('databreaches-list')).data['results']), 0)
+
+        out = self.run_jobs()
+        self.assertIn('Import job %d done: 4 data breaches imported (2 failed)' % response.data['id'], out)
+        self.assertEqual(DataBreach.objects.count(), 4)
+        self.assertEqual(len(self.client.get(reverse('databreaches-list')).data['results']), 4)
+
+        response = self.client.get(status_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data['status'], 'done')
+        self.assertEqual((response.data['processed'], response.data['created'], response.data['failed']), (6, 4, 2))
+        self.assertEqual([error['index'] for error in response.data['errors']], [2, 5])
+        self.assertGreater(response.data['throughput'], 0)
+        self.assertEqual(ImportJob.objects.get(id=response.data['id']).payload, '')
+
+        # jobs are processed once
+        self.assertEqual(self.run_jobs(), '')
+        self.assertEqual(DataBreach.objects.count(), 4)
+
+    def test_import_job_ndjson(self):
+        """NDJSON payloads should be imported, unreadable ones should fail the job."""
+        content = '\n'.join(json.dumps(dt) for dt in PopulateDbTestCase.data)
+        response = self.client.generic('POST', self.imports_url, content, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED, response.data)
+        response = self.client.generic('POST', self.imports_url, '[{"year" : 2020}', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED, response.data)
+        failed_url = response['Location']
+
+        self.run_jobs()
+        self.assertEqual(DataBreach.objects.count(), 2)
+        response = self.client.get(failed_url)
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertIn('Not possible to read the payload', response.data['error'])
+
+    def test_import_job_errors(self):
+        """Jobs stopped by any error and jobs left running by a stopped worker
+        should be marked as failed without stopping the worker.
+        """
+        stale = ImportJob.objects.create(status=ImportJob.RUNNING, started_at=timezone.now(), payload='[]')
+        nested = ImportJob.objects.create(payload='[' * 100000 + ']' * 100000)
+        valid = ImportJob.objects.create(payload=json.dumps(PopulateDbTestCase.data))
+
+        out = self.run_jobs()
+        self.assertIn('Marked 1 import jobs left running by a stopped worker as failed.', out)
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.payload), ('failed', ''))
+        nested.refresh_from_db()
+        self.assertEqual(nested.status, 'failed')
+        self.assertIn('RecursionError', nested.error)
+        valid.refresh_from_db()
+        self.assertEqual(valid.status, 'done')
+        self.assertEqual(DataBreach.objects.count(), 2)
+
+        # errors of the import are not reported as unreadable payloads
+        job = ImportJob.objects.create(payload=json.dumps(PopulateDbTestCase.data))
+        with mock.patch.object(BulkImporter, 'load', side_effect=ValueError('bad value')):
+            self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('failed', 'The import stopped: ValueError: bad value'))
+
+    def test_import_job_invalidation(self):
+        """Cached responses should be invalidated after every batch of a job,
+        not only when the whole job is over.
+        """
+        ImportJob.objects.create(payload=json.dumps(PopulateDbTestCase.data), batch_size=1)
+        version = DatasetVersion.objects.get(pk=1).version
+        self.run_jobs()
+        self.assertEqual(DatasetVersion.objects.get(pk=1).version, version + 2)
+
+    def test_import_job_validation(self):
+        """Empty, too big and unauthenticated uploads should be refused."""
+        response = self.client.generic('POST', self.imports_url, '  ', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(DATA_BREACHES_MAX_IMPORT_SIZE=10):
+            response = self.client.post(self.imports_url, PopulateDbTestCase.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(ImportJob.objects.exists())
+
+        self.client.credentials()
+        response = self.client.post(self.imports_url, PopulateDbTestCase.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class FastJSONTestCase(SimpleTestCase):
+    def setUp(self):
+        self.data = [
+            {
+                'id' : i,
+                'entity' : {'name' : 'Entity \u00e9 "%d" \u2028 \u2029 \x00' % i, 'organization_type' : ['web', 'retail']},
+                'year' : 2020,
+                'records' : 1000 + i,
+                'method' : None,
+                'sources' : ['https://example.com/%d' % i],
+                'date' : timezone.now(),
+                'delay' : timedelta(seconds=i),
+            }
+            for i in range(10)
+        ]
+
+    def test_renderer(self):
+        """FastJSONRenderer should output the same bytes as JSONRenderer,
+        with and without orjson.
+        """
+        for data in [self.data, {'count' : 10, 'results' : self.data}, {1 : 'a'}, {'a' : 2**70}, [], None]:
+            expected = JSONRenderer().render(data)
+            self.assertEqual(renderers.FastJSONRenderer().render(data), expected)
+            with mock.patch.object(renderers, 'orjson', None):
+                self.assertEqual(renderers.FastJSONRenderer().render(data), expected)
+
+        self.assertEqual(
+            renderers.FastJSONRenderer().render(self.data, 'application/json; indent=4'),
+            JSONRenderer().render(self.data, 'application/json; indent=4')
+        )
+
+    def test_parser(self):
+        """FastJSONParser should parse the same data as JSONParser and raise
+        the same errors.
+        """
+        for body in [JSONRenderer().render(self.data), '{"name" : "\u00e9"}'.encode()]:
+            expected = JSONParser().parse(BytesIO(body))
+            self.assertEqual(str(renderers.FastJSONParser().parse(BytesIO(body))), str(expected))
+
+        for body in [b'{"year" : 2020', b'', b'{"records" : NaN}']:
+            with self.assertRaises(ParseError) as expected:
+                JSONParser().parse(BytesIO(body))
+            with self.assertRaises(ParseError) as error:
+                renderers.FastJSONParser().parse(BytesIO(body))
+            self.assertEqual(str(error.exception), str(expected.exception))
+
+class BenchmarkTestCase(APITestCase):
+    """Test case for the benchmark suites, run on a tiny dataset."""
+    def setUp(self):
+        benchmarks._loaded.clear()
+        cache.clear()
+
+    def test_generate_databreaches(self):
+        """Generated data breaches should be the same for the same seed and
+        valid for the importers.
+        """
+        data = list(benchmarks.generate_databreaches(300))
+        self.assertEqual(data, list(benchmarks.generate_databreaches(300)))
+        self.assertNotEqual(data, list(benchmarks.generate_databreaches(300, seed=1)))
+        self.assertLess(len({dt['entity']['name'] for dt in data}), 300)
+
+        importer = BulkImporter()
+        importer.load(data)
+        self.assertEqual((importer.created, importer.failed), (300, 0))
+
+    def test_suites(self):
+        """Every suite should run and report time, queries and memory of each measure."""
+        for name, suite in benchmarks.SUITES.items():
+            kwargs = {'repeat' : 1}
+            if 'size' in inspect.signature(suite).parameters:
+                kwargs['size'] = 20
+            results = suite(**kwargs)
+            measures = list(find_measures({name : results}))
+            self.assertTrue(measures, name)
+            for path, measure in measures:
+                self.assertEqual(measure['calls'], 1)
+                for key in ['seconds', 'us_per_call', 'queries_per_call', 'peak_memory_kb']:
+                    self.assertIn(key, measure)
+
 class MethodsTestCase(APITestCase):
     pass
 
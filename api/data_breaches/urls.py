@@ -4,6 +4,7 @@ from .views import *
 
 router = routers.DefaultRouter()
 router.register(r'databreaches', DataBreachViewSet, basename='databreaches')
+router.register(r'imports', ImportJobViewSet, basename='imports')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,11 +1,25 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
-from rest_framework import viewsets, response, status
+from django.urls import reverse
+from rest_framework import mixins, viewsets, response, status
 from rest_framework.decorators import action
-from rest_framework.permissions import BasePermission, IsAuthenticated, SAFE_METHODS
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny, BasePermission, IsAuthenticated, SAFE_METHODS
 from rest_framework_api_key.permissions import HasAPIKey
 from rest_framework.authentication import TokenAuthentication
+from .bulk import delete_databreaches, update_databreaches
+from .caching import cache_response, condition_on_version, defer_invalidation
+from .filters import DataBreachFilter
+from .importers import batched
 from .models import *
+from .pagination import DataBreachCursorPagination
+from .permissions import CachedHasAPIKey
+from .renderers import CSVRenderer, NDJSONRenderer
+from .representations import parse_fieldset, sparse_queryset
+from .search import autocomplete_entities
 from .serializers import *
+from .stats import databreach_stats
 
 class ReadOnly(BasePermission):
     def has_permission(self, request, view):
@@ -47,10 +61,205 @@ class DataBreachViewSet(viewsets.ModelViewSet):
             ]
     }
     ```
+
+    Many data breaches can be created at once sending a list of data breaches
+    like the one above. The whole list is validated first and then created in
+    a single transaction, so either every data breach is created or none is.
+
+    The list of data breaches is paginated with cursors. Follow the `next` and
+    `previous` links of the response to move between pages and use the
+    `page_size` query parameter to choose how many data breaches each page
+    has.
+
+    The list can be filtered by `year` (also `year__gte` and `year__lte`),
+    `method`, `records__gte`, `records__lte`, `entity` name and
+    `organization_type`. Example:
+
+    ```code
+    /api/databreaches/?year__gte=2015&records__gte=1000000&organization_type=web
+    ```
+
+    Use the `fields` query parameter to get only some of the `id`,
+    `entity.name`, `year`, `records` and `method` fields, and the `expand`
+    query parameter to include the `organization_type` and `sources`
+    relations, which are left out when either parameter is used. Example:
+
+    ```code
+    /api/databreaches/?fields=id,entity.name,year,records&expand=sources
+    ```
+
+    Use the `search` query parameter to find data breaches by entity name or
+    source url, and the `autocomplete` action to complete entity names.
+
+    List and detail responses are cached until the data changes, see the
+    `DATA_BREACHES_CACHE` setting. They carry `ETag` and `Last-Modified`
+    headers built from the data version, send them back on `If-None-Match` and
+    `If-Modified-Since` headers to get a 304 response when nothing changed.
     """
+    # data breaches are read with their stored representation, see
+    # `representations`, so list and detail only query the DataBreach table
     queryset = DataBreach.objects.all()
     serializer_class = DataBreachSerializer
-    permission_classes = [HasAPIKey | IsAuthenticated | ReadOnly]
+    pagination_class = DataBreachCursorPagination
+    filterset_class = DataBreachFilter
+    # read only requests are checked first so reads never verify api keys
+    permission_classes = [ReadOnly | CachedHasAPIKey | IsAuthenticated]
+
+    def get_fieldset(self):
+        """
+        Parse the `fields` and `expand` query parameters of list, detail,
+        batch and by source requests, see `parse_fieldset`.
+
+        Returns:
+            The fieldset, or None for other actions and when the full
+            representation is wanted.
+        """
+        if self.action not in ('list', 'retrieve', 'batch', 'by_source'):
+            return None
+        try:
+            return parse_fieldset(self.request.query_params.get('fields'), self.request.query_params.get('expand'))
+        except ValueError as e:
+            raise ValidationError({'fields' : [str(e)]})
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fieldset = self.get_fieldset()
+        if fieldset is not None:
+            queryset = sparse_queryset(queryset, fieldset)
+        return queryset
+
+    @condition_on_version
+    @cache_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @condition_on_version
+    @cache_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    @condition_on_version
+    @cache_response
+    def stats(self, request, *args, **kwargs):
+        """
+        Statistics of the data breaches computed in the database: totals, count,
+        total and max records by year, method and organization type, and the
+        entities with most records leaked. The same filters of the list can be
+        used. Use the `top` query parameter to choose how many entities are
+        listed (default 10, at most 100).
+        """
+        try:
+            top = min(max(int(request.query_params.get('top', 10)), 0), 100)
+        except ValueError:
+            return response.Response({'top' : ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(DataBreach.objects.all())
+        return response.Response(databreach_stats(queryset, top=top))
+
+    @action(detail=False, methods=['get'])
+    @condition_on_version
+    @cache_response
+    def autocomplete(self, request, *args, **kwargs):
+        """
+        Names of the entities matching the `q` query parameter, to autocomplete
+        entity searches. Names starting with the query come first, followed by
+        the ones with a word starting with each word of the query. Use the
+        `limit` query parameter to choose how many names are returned (default
+        10, at most 100).
+        """
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 0), 100)
+        except ValueError:
+            return response.Response({'limit' : ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        return response.Response(autocomplete_entities(request.query_params.get('q', ''), limit=limit))
+
+    @action(detail=False, methods=['get'], url_path='by-source')
+    @condition_on_version
+    @cache_response
+    def by_source(self, request, *args, **kwargs):
+        """
+        Data breaches citing the source with the exact `url` query parameter,
+        found through the unique index of the source urls. The response is
+        paginated like the list, and its filters and the `fields` and `expand`
+        query parameters can be used.
+        """
+        url = request.query_params.get('url')
+        if not url:
+            return response.Response({'url' : ['This query parameter is required.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset()).filter(sources__url=url)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get', 'post'], permission_classes=[AllowAny])
+    def batch(self, request, *args, **kwargs):
+        """
+        Look up many data breaches by id at once, with a few queries no matter
+        how many are asked for. Send the ids on the `ids` query parameter
+        (`?ids=1,2,3`) or, for long lists, on a POST body like
+        `{"ids" : [1, 2, 3]}`. At most `DATA_BREACHES_MAX_BATCH_SIZE` ids are
+        accepted at a time.
+
+        The response has the data breaches keyed by id in `results`, in the
+        order they were asked for, and the ids not found in `missing`. The
+        `fields` and `expand` query parameters of the list can be used.
+        """
+        if request.method == 'GET':
+            return self.batch_get(request, *args, **kwargs)
+        return self.batch_response(request.data)
+
+    @condition_on_version
+    @cache_response
+    def batch_get(self, request, *args, **kwargs):
+        ids = [pk for value in request.query_params.getlist('ids') for pk in value.split(',') if pk.strip()]
+        return self.batch_response({'ids' : ids})
+
+    def batch_response(self, data):
+        serializer = DataBreachIdsSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+
+        databreaches = {
+            databreach.id : databreach
+            for databreach in self.get_queryset().filter(id__in=ids)
+        }
+        found = [databreaches[pk] for pk in ids if pk in databreaches]
+        results = self.get_serializer(found, many=True).data
+        return response.Response({
+            # json object keys are strings
+            'results' : {str(databreach.id) : data for databreach, data in zip(found, results)},
+            'missing' : [pk for pk in ids if pk not in databreaches],
+        })
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    @condition_on_version
+    def export(self, request, *args, **kwargs):
+        """
+        Export all data breaches as newline delimited json (`?format=ndjson`,
+        the default) or csv (`?format=csv`). The same filters of the list can be
+        used.
+
+        The export is streamed: data breaches are read from the database in
+        chunks, with their stored representation, and written as they are read.
+        """
+        queryset = self.filter_queryset(self.get_queryset()).order_by('id')
+        renderer = request.accepted_renderer
+
+        list_serializer = self.get_serializer(many=True)
+        rows = (
+            row
+            for chunk in batched(queryset.iterator(chunk_size=2000), 2000)
+            for row in list_serializer.to_representation(chunk)
+        )
+        resp = StreamingHttpResponse(
+            renderer.stream(rows),
+            content_type='%s; charset=%s' % (renderer.media_type, renderer.charset)
+        )
+        resp['Content-Disposition'] = 'attachment; filename="databreaches.%s"' % renderer.format
+        return resp
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data, many=isinstance(request.data, list))
@@ -64,9 +273,17 @@ class DataBreachViewSet(viewsets.ModelViewSet):
         The data is passed as 'extra' dict.
         """
         context = super(DataBreachViewSet, self).get_serializer_context()
-        entity_data = self.request.data.get('entity', None)
+        context['fieldset'] = self.get_fieldset()
         extra_data = {
         }
+        # a list of data breaches carries its extra data in each item
+        if isinstance(self.request.data, list):
+            context.update({
+                'extra' : extra_data
+            })
+            return context
+
+        entity_data = self.request.data.get('entity', None)
         if entity_data:
             extra_data['entity'] = entity_data
         sources_data = self.request.data.get('sources', None)
@@ -77,13 +294,134 @@ class DataBreachViewSet(viewsets.ModelViewSet):
         })
         return context
 
+    def perform_create(self, serializer):
+        with defer_invalidation():
+            serializer.save()
+
+    def perform_update(self, serializer):
+        with defer_invalidation():
+            serializer.save()
+
     def destroy(self, request, *args, **kwargs):
-        """Override to delete sources when data breach is deleted."""
+        """Override to delete the sources of the data breach along with it."""
         instance = self.get_object()
-        with transaction.atomic():
-            sources = Source.objects.filter(data_breach=instance)
-            for s in sources:
-                s.delete()
-            self.perform_destroy(instance)
+        with defer_invalidation():
+            with transaction.atomic():
+                delete_databreaches(DataBreach.objects.filter(pk=instance.pk), delete_orphans=False)
 
         return response.Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['post'], url_path='bulk-delete')
+    def bulk_delete(self, request, *args, **kwargs):
+        """
+        Delete many data breaches at once, selected by a list of `ids` or a
+        `filter` with the filters of the list. Their sources, and the entities
+        left without data breaches with their organization types, are deleted
+        too, in a single transaction. Example:
+
+        ```code
+        {"ids" : [1, 2, 3]}
+        {"filter" : {"entity" : "Test", "year" : 2021}}
+        ```
+
+        The response has the amount of data breaches, sources, entities and
+        organization types deleted, and the `missing` ids that were not found.
+        """
+        serializer = DataBreachSelectionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queryset = serializer.get_queryset()
+
+        with defer_invalidation():
+            with transaction.atomic():
+                missing = []
+                if 'ids' in serializer.validated_data:
+                    found = set(queryset.values_list('id', flat=True))
+                    missing = sorted(set(serializer.validated_data['ids']) - found)
+                deleted = delete_databreaches(queryset)
+
+        return response.Response(dict(deleted, missing=missing))
+
+    @action(detail=False, methods=['patch'], url_path='bulk-update')
+    def bulk_update(self, request, *args, **kwargs):
+        """
+        Change the `year`, `records` or `method` of many data breaches at once,
+        in a single transaction. Send either a list of partial updates with the
+        id of each data breach, or the same `values` for a selection of data
+        breaches, by `ids` or `filter` like in `bulk-delete`. Example:
+
+        ```code
+        [{"id" : 1, "method" : "hacked"}, {"id" : 2, "year" : 2019, "records" : 5000}]
+        {"filter" : {"entity" : "Test", "method" : "hackd"}, "values" : {"method" : "hacked"}}
+        ```
+
+        The response has the amount of data breaches `updated`, `unchanged`
+        and `not_found`, and the status of each one in `results`. At most
+        `MAX_BULK_SIZE` data breaches are updated at a time, filters selecting
+        more are refused.
+        """
+        if isinstance(request.data, list):
+            serializer = DataBreachChangeSerializer(data=request.data, many=True, allow_empty=False, max_length=MAX_BULK_SIZE)
+            serializer.is_valid(raise_exception=True)
+            changes = {item.pop('id'): item for item in serializer.validated_data}
+            queryset = None
+        else:
+            serializer = DataBreachBulkUpdateSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            queryset = serializer.get_queryset()
+            values = serializer.validated_data['values']
+
+        with defer_invalidation():
+            with transaction.atomic():
+                if queryset is not None:
+                    ids = list(queryset.order_by('id').values_list('id', flat=True)[:MAX_BULK_SIZE + 1])
+                    if len(ids) > MAX_BULK_SIZE:
+                        raise ValidationError({
+                            'filter' : ['The filter selects more than %d data breaches.' % MAX_BULK_SIZE]
+                        })
+                    changes = dict.fromkeys(ids, values)
+                results = update_databreaches(changes)
+
+        summary = {name : 0 for name in ['updated', 'unchanged', 'not_found']}
+        for result in results.values():
+            summary[result] += 1
+        summary['results'] = [{'id' : pk, 'status' : result} for pk, result in results.items()]
+        return response.Response(summary)
+
+class ImportJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Import many data breaches in the background, without holding a web worker
+    for the whole import. The api key is needed like on data breaches writes.
+
+    POST the data breaches, as a json array like the one sent to the data
+    breaches list or with one data breach per line (NDJSON), to get a job in
+    a 202 response right away. The payload is only stored, the
+    `run_import_jobs` command imports it in batches. Follow the `Location`
+    header of the response to the status of the job, with the amount of data
+    breaches `processed`, `created` and `failed` so far, the `throughput` in
+    data breaches per second and the `errors` of the first failed ones, by
+    their `index` in the payload.
+    """
+    queryset = ImportJob.objects.defer('payload')
+    serializer_class = ImportJobSerializer
+    permission_classes = [CachedHasAPIKey | IsAuthenticated]
+
+    def create(self, request, *args, **kwargs):
+        # the body is stored as sent, parsing it is left to the worker
+        max_size = getattr(settings, 'DATA_BREACHES_MAX_IMPORT_SIZE', 100 * 1024 * 1024)
+        stream = request.stream
+        body = stream.read(max_size + 1) if stream is not None else b''
+        if len(body) > max_size:
+            return response.Response(
+                {'detail' : 'The payload is bigger than %d bytes.' % max_size},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        try:
+            payload = body.decode('utf-8')
+        except UnicodeDecodeError:
+            return response.Response({'detail' : 'The payload must be utf-8 encoded.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not payload.strip():
+            return response.Response({'detail' : 'The payload is empty.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = ImportJob.objects.create(payload=payload)
+        headers = {'Location' : reverse('imports-detail', args=[job.pk])}
+        return response.Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED, headers=headers)